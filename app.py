@@ -1,20 +1,42 @@
 import os
+import sys
+import signal
 import sqlite3
 import uuid
 import json
-
-from flask import Flask, g, request, jsonify, render_template, redirect, url_for, session, abort
+import threading
+import time
+import base64
+import queue
+import atexit
+import hashlib
+import math
+import itertools
+from bisect import bisect_left
+
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, abort, flash, g, has_request_context
 from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
 from werkzeug.security import check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 from datetime import datetime, timezone, timedelta
 
 import firebase_admin
 from firebase_admin import credentials, db as firebase_db, storage, firestore
 
+from catalog_manifest import (
+    IMAGE_EXTENSIONS, THUMB_WIDTHS, THUMB_FORMATS, THUMB_CACHE_CONTROL, MANIFEST_BLOB,
+    parse_filename, thumb_blob_name, render_derivatives, build_image_entry, list_catalog_entries,
+    admin_search_match, search_bucket_images,
+    decode_manifest, manifest_version, load_manifest_file, update_manifest
+)
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "change-this-key")
-CORS(app)  # Flask 앱 전체에 CORS 허용
+CORS(app, expose_headers=["ETag"])  # Flask 앱 전체에 CORS 허용 (조건부 GET 용 ETag 노출)
 
 def get_kst_date():
     kst = timezone(timedelta(hours=9))
@@ -65,15 +87,97 @@ db = firestore.client()
 # DB helpers (SQLite 백업용으로 유지)
 # ────────────────────────────────────────────
 
+SQLITE_STATEMENT_CACHE = 64
+
+# 고정 쿼리 - 같은 문자열을 재사용해야 sqlite3 의 prepared statement 캐시가 적중함
+SQL_SELECT_LOCK = "SELECT locked FROM user_locks WHERE user_id = ?"
+SQL_UPSERT_LOCK = "INSERT INTO user_locks (user_id, locked) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET locked = excluded.locked, locked_at = CURRENT_TIMESTAMP"
+SQL_INSERT_FRIEND = "INSERT OR IGNORE INTO friends VALUES (?,?)"
+SQL_SELECT_FRIENDS = "SELECT friend_id FROM friends WHERE user_id = ?"
+SQL_SELECT_USER_DATA = "SELECT data FROM user_data WHERE user_id = ?"
+SQL_UPSERT_USER_DATA = "INSERT INTO user_data (user_id, data, version) VALUES (?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, version = excluded.version"
+SQL_INSERT_EMPTY_USER = "INSERT INTO user_data (user_id, data) VALUES (?, '{}')"
+SQL_ENSURE_USER = "INSERT OR IGNORE INTO user_data (user_id, data) VALUES (?, '{}')"
+# 카드 단위 부분 갱신 - 전체 JSON 을 다시 직렬화하지 않고 SQLite JSON1 로 제자리 수정
+_SQL_USER_DATA_OBJECT = "CASE WHEN json_valid(data) THEN CASE WHEN json_type(data) = 'object' THEN data ELSE '{}' END ELSE '{}' END"
+SQL_SET_USER_CARD = f"UPDATE user_data SET data = json_set({_SQL_USER_DATA_OBJECT}, ?, json(?)), version = ? WHERE user_id = ?"
+SQL_REMOVE_USER_CARD = f"UPDATE user_data SET data = json_remove({_SQL_USER_DATA_OBJECT}, ?), version = ? WHERE user_id = ?"
+# 삭제 후 비게 된 상위 노드 제거 (RTDB 는 빈 노드를 저장하지 않음)
+SQL_PRUNE_EMPTY_NODE = "UPDATE user_data SET data = json_remove(data, ?) WHERE user_id = ? AND json_valid(data) AND json_extract(data, ?) = '{}'"
+# 로컬 복제본 동기화 - 더 오래된 버전으로 덮어쓰지 않음
+SQL_SYNC_USER_DATA = "INSERT INTO user_data (user_id, data, version) VALUES (?, ?, ?) ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, version = excluded.version WHERE user_data.version IS NULL OR user_data.version <= excluded.version"
+SQL_SYNC_FRIENDS_DELETE = "DELETE FROM friends WHERE user_id = ? AND friend_id NOT IN (SELECT value FROM json_each(?))"
+SQL_SYNC_FRIENDS_INSERT = "INSERT OR IGNORE INTO friends SELECT ?, value FROM json_each(?)"
+SQL_SELECT_STAMP = "SELECT version, synced_at FROM replica_stamps WHERE kind = ? AND key = ?"
+SQL_UPSERT_STAMP = "INSERT INTO replica_stamps (kind, key, version, synced_at) VALUES (?, ?, ?, ?) ON CONFLICT(kind, key) DO UPDATE SET version = excluded.version, synced_at = excluded.synced_at WHERE replica_stamps.version IS NULL OR excluded.version IS NULL OR replica_stamps.version <= excluded.version"
+SQL_ADVANCE_STAMP = "UPDATE replica_stamps SET version = ?, synced_at = ? WHERE kind = ? AND key = ? AND version = ?"
+SQL_DELETE_OTHER_STAMP = "DELETE FROM replica_stamps WHERE kind = ? AND key = ? AND version IS NOT ?"
+SQL_DELETE_STAMP = "DELETE FROM replica_stamps WHERE kind = ? AND key = ?"
+
+def connect_sqlite(path=DATABASE, check_same_thread=True):
+    """WAL 모드 연결 - 읽기가 writer 에 막히지 않음"""
+    conn = sqlite3.connect(
+        path, timeout=30, cached_statements=SQLITE_STATEMENT_CACHE, check_same_thread=check_same_thread
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", 8))  # 보관할 유휴 연결 최대 개수
+
+class SqlitePool:
+    """요청 스레드용 연결 풀 - 개발 서버는 요청마다 새 스레드이므로 스레드별 연결은 재사용되지 않음
+
+    한 번에 한 스레드만 쓰도록 빌려주고 돌려받으므로 check_same_thread 를 끔.
+    유휴 연결이 maxsize 를 넘으면 닫음.
+    """
+
+    def __init__(self, path, maxsize):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=maxsize)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect_sqlite(self.path, check_same_thread=False)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+sqlite_pool = SqlitePool(DATABASE, SQLITE_POOL_SIZE)
+_local = threading.local()
+
 def get_db():
-    db = getattr(g, "_database", None)
-    if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-    return db
+    """요청 안에서는 풀에서 빌린 연결(요청이 끝나면 반환), 밖에서는 스레드별 연결
+
+    요청 밖에서 호출하는 스레드(io_pool, reconciler, 헬스 체크)는 계속 살아 있으므로 스레드별로 유지.
+    """
+    if has_request_context():
+        conn = g.get("sqlite_conn")
+        if conn is None:
+            conn = g.sqlite_conn = sqlite_pool.acquire()
+        return conn
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect_sqlite()
+    return conn
+
+@app.teardown_request
+def release_db(exc):
+    conn = g.pop("sqlite_conn", None)
+    if conn is not None:
+        sqlite_pool.release(conn)
 
 def init_db():
-    with app.app_context():
-        cur = get_db().cursor()
+    conn = connect_sqlite()
+    try:
+        cur = conn.cursor()
         # 1) 유저별 보유 정보
         cur.execute(
             """CREATE TABLE IF NOT EXISTS user_data (
@@ -97,56 +201,693 @@ def init_db():
                    locked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                )"""
         )
-        get_db().commit()
+        # 4) 로컬 복제본 동기화 시각 (LOCAL_FIRST 읽기용)
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS replica_stamps (
+                   kind      TEXT,
+                   key       TEXT,
+                   version   INTEGER,
+                   synced_at REAL,
+                   PRIMARY KEY (kind, key)
+               )"""
+        )
+        # 5) user_data.version 컬럼 추가 (이전 스키마 마이그레이션)
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(user_data)")]
+        if "version" not in columns:
+            cur.execute("ALTER TABLE user_data ADD COLUMN version INTEGER")
+        conn.commit()
+    finally:
+        conn.close()
 
-@app.before_request
-def _ensure_db():
-    if not getattr(app, "_db_init", False):
-        init_db()
-        app._db_init = True
+# 스키마 초기화는 프로세스 시작 시 한 번만
+init_db()
 
-@app.teardown_appcontext
-def close_connection(exc):
-    db = getattr(g, "_database", None)
-    if db is not None:
-        db.close()
+# ────────────────────────────────────────────
+# SQLite 백업 미러 (write-behind 큐)
+# ────────────────────────────────────────────
+
+MIRROR_QUEUE_SIZE = int(os.environ.get("MIRROR_QUEUE_SIZE", 10000))
+MIRROR_BATCH_SIZE = int(os.environ.get("MIRROR_BATCH_SIZE", 200))
+
+class SqliteMirror:
+    """요청 스레드 대신 백그라운드 writer 가 SQLite 백업 쓰기를 배치로 처리
+
+    큐가 가득 차면 자리가 날 때까지 요청 스레드가 기다림(backpressure).
+    요청 스레드에서 직접 기록하면 큐에 남은 이전 쓰기보다 먼저 커밋되므로 항상 큐를 거침 (FIFO).
+    """
+
+    _STOP = object()
+
+    def __init__(self, path, maxsize, batch_size):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._written = 0
+        self._batches = 0
+        self._errors = 0
+        self._blocked_writes = 0
+        self._last_commit_at = None
+        self._last_enqueued_at = None  # 마지막으로 커밋된 항목이 큐에 들어간 시각
+
+    def write(self, sql, params=(), wait=False):
+        """쓰기 작업을 큐에 넣음 - wait=True 면 커밋될 때까지 대기"""
+        self._ensure_started()
+        done = threading.Event() if wait else None
+        item = (sql, params, time.monotonic(), done)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._blocked_writes += 1
+            self._queue.put(item)
+        if done is not None:
+            done.wait()
+
+    def flush(self, timeout=None):
+        """지금까지 넣은 작업이 모두 커밋될 때까지 대기 - timeout 은 큐에 넣는 시간까지 포함"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        started = time.monotonic()
+        try:
+            self._queue.put((None, None, started, done), timeout=timeout)
+        except queue.Full:
+            return False
+        if timeout is not None:
+            timeout = max(timeout - (time.monotonic() - started), 0)
+        return done.wait(timeout)
+
+    def barrier(self):
+        """지금까지 넣은 작업 뒤에 표시를 넣고 그 시각 반환 (기다리지 않음)"""
+        if self._thread is None:
+            return None
+        enqueued_at = time.monotonic()
+        self._queue.put((None, None, enqueued_at, None))
+        return enqueued_at
+
+    def committed(self, barrier):
+        """barrier() 이전에 넣은 작업이 모두 커밋되었는지"""
+        last = self._last_enqueued_at
+        return barrier is None or (last is not None and last >= barrier)
+
+    def close(self, timeout=10):
+        """종료 시 남은 작업을 모두 기록하고 writer 종료"""
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        pending = self._queue.qsize()
+        lag = 0.0
+        if pending and self._last_enqueued_at is not None:
+            lag = round(time.monotonic() - self._last_enqueued_at, 3)
+        return {
+            "pending": pending,
+            "lag_seconds": lag,
+            "written": self._written,
+            "batches": self._batches,
+            "errors": self._errors,
+            "blocked_writes": self._blocked_writes,
+            "last_commit_seconds_ago": (
+                round(time.monotonic() - self._last_commit_at, 1)
+                if self._last_commit_at is not None else None
+            )
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-mirror", daemon=True)
+                self._thread.start()
+
+    def _commit(self, conn, ops):
+        try:
+            with conn:
+                for sql, params in ops:
+                    conn.execute(sql, params)
+            with self._lock:
+                self._written += len(ops)
+        except Exception as e:
+            # 배치 실패 시 하나씩 다시 시도해서 문제 항목만 건너뜀
+            print(f"SQLite 미러 배치 오류, 개별 재시도: {e}")
+            for sql, params in ops:
+                try:
+                    with conn:
+                        conn.execute(sql, params)
+                    with self._lock:
+                        self._written += 1
+                except Exception as e:
+                    with self._lock:
+                        self._errors += 1
+                    print(f"SQLite 미러 기록 실패: {e}")
+
+    def _run(self):
+        conn = connect_sqlite(self.path)
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            # 쌓여 있는 작업을 한 트랜잭션으로 묶음
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            ops, waiters, last_enqueued = [], [], self._last_enqueued_at
+            for item in batch:
+                if item is self._STOP:
+                    stopping = True
+                    continue
+                sql, params, enqueued_at, done = item
+                if sql is not None:
+                    ops.append((sql, params))
+                if done is not None:
+                    waiters.append(done)
+                # 큐가 가득 차서 기다린 항목은 시각이 앞설 수 있으므로 최댓값 유지
+                last_enqueued = enqueued_at if last_enqueued is None else max(last_enqueued, enqueued_at)
+
+            if ops:
+                self._commit(conn, ops)
+                with self._lock:
+                    self._batches += 1
+            self._last_commit_at = time.monotonic()
+            self._last_enqueued_at = last_enqueued
+            for done in waiters:
+                done.set()
+
+            if stopping:
+                # 종료 신호 이후 남은 작업까지 기록
+                leftover = []
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not self._STOP:
+                        leftover.append(item)
+                rest = [(sql, params) for sql, params, _, _ in leftover if sql is not None]
+                if rest:
+                    self._commit(conn, rest)
+                for _, _, _, done in leftover:
+                    if done is not None:
+                        done.set()
+        conn.close()
+
+sqlite_mirror = SqliteMirror(DATABASE, MIRROR_QUEUE_SIZE, MIRROR_BATCH_SIZE)
+atexit.register(sqlite_mirror.close)
+
+# ────────────────────────────────────────────
+# 동시성 도구 + RTDB 읽기 합치기 (single-flight)
+# ────────────────────────────────────────────
+
+_MISSING = object()
+
+class SingleFlight:
+    """같은 키에 대한 동시 호출을 하나의 실행으로 합침"""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+class TTLCache:
+    """크기 제한 LRU + TTL 캐시 (스레드 안전)"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (만료 시각, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# Firebase 읽기를 병렬로 보내기 위한 공용 스레드 풀
+IO_POOL_SIZE = int(os.environ.get("IO_POOL_SIZE", 16))
+io_pool = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+# 친구 일괄 조회/트레이드 매칭처럼 요청 하나가 수백 건을 읽는 작업용 - io_pool 의 단건 읽기를 막지 않도록 분리
+FANOUT_POOL_SIZE = int(os.environ.get("FANOUT_POOL_SIZE", 16))
+fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_POOL_SIZE, thread_name_prefix="fanout")
+
+RTDB_MICROCACHE_MS = int(os.environ.get("RTDB_MICROCACHE_MS", 0))  # 0 이면 마이크로 캐시 사용 안 함
+
+class RtdbReader:
+    """같은 경로의 동시 RTDB 읽기를 한 번의 요청으로 합치고, 선택적으로 아주 짧게 캐시
+
+    반환값은 여러 요청이 공유하므로 호출 측에서 수정하지 말 것.
+    """
+
+    def __init__(self, microcache_ms):
+        self._flight = SingleFlight()
+        self._cache = TTLCache(10000, microcache_ms / 1000) if microcache_ms > 0 else None
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._requests = 0
+        self._fetches = 0
+        self._cache_hits = 0
+
+    def get(self, path):
+        path = path.strip("/")
+        with self._lock:
+            self._requests += 1
+        if self._cache is not None:
+            value = self._cache.get(path, _MISSING)
+            if value is not _MISSING:
+                with self._lock:
+                    self._cache_hits += 1
+                return value
+        # 세대를 키에 포함 - 쓰기(invalidate) 이후의 읽기는 그 전에 시작된 조회에 합류하지 않음
+        generation = self._generation
+        return self._flight.do((path, generation), lambda: self._fetch(path, generation))
+
+    def _fetch(self, path, generation):
+        with self._lock:
+            self._fetches += 1
+        value = firebase_db.reference(path).get()
+        # 읽는 도중 쓰기가 있었다면 캐시하지 않음
+        if self._cache is not None and generation == self._generation:
+            self._cache.set(path, value)
+        return value
+
+    def invalidate(self, *paths):
+        """쓰기 후 호출 - 해당 경로와 상위/하위 경로의 캐시 제거"""
+        with self._lock:
+            self._generation += 1
+        if self._cache is None:
+            return
+        paths = [p.strip("/") for p in paths]
+
+        def related(key):
+            return any(
+                not p or key == p or key.startswith(p + "/") or p.startswith(key + "/")
+                for p in paths
+            )
+        self._cache.discard_if(related)
+
+    def stats(self):
+        with self._lock:
+            requests, fetches, hits = self._requests, self._fetches, self._cache_hits
+        coalesced = max(requests - fetches - hits, 0)
+        return {
+            "requests": requests,
+            "fetches": fetches,
+            "coalesced": coalesced,
+            "cache_hits": hits,
+            "coalescing_ratio": round(requests / fetches, 2) if fetches else None
+        }
+
+rtdb_reader = RtdbReader(RTDB_MICROCACHE_MS)
+rtdb_get = rtdb_reader.get
+
+# ────────────────────────────────────────────
+# 로컬 우선 읽기 (SQLite 복제본, LOCAL_FIRST=1)
+# ────────────────────────────────────────────
+
+LOCAL_FIRST = os.environ.get("LOCAL_FIRST", "0") == "1"
+LOCAL_RECONCILE_INTERVAL = float(os.environ.get("LOCAL_RECONCILE_INTERVAL", 5))  # 초
+LOCAL_HOT_WINDOW = int(os.environ.get("LOCAL_HOT_WINDOW", 600))  # 이 시간 안에 읽힌 키만 동기화
+LOCAL_HOT_MAX = int(os.environ.get("LOCAL_HOT_MAX", 50000))
+LOCAL_RECONCILE_BATCH = int(os.environ.get("LOCAL_RECONCILE_BATCH", 500))
+LOCAL_RECONCILE_WORKERS = int(os.environ.get("LOCAL_RECONCILE_WORKERS", 4))  # 요청 경로 풀과 별도
+
+# 엔드포인트별 허용 지연(초) - 예: LOCAL_MAX_AGE="user_data=2,friend_collection=60"
+LOCAL_MAX_AGE = {
+    "user_data": 5,           # GET /api/user/<uid>
+    "friend_collection": 30,  # 친구 컬렉션 (단건/일괄)
+    "friends": 30,            # 친구 목록
+    "user_locks": 5,          # 잠금 상태 (공개 여부에 영향을 주므로 짧게)
+}
+for _item in filter(None, os.environ.get("LOCAL_MAX_AGE", "").split(",")):
+    _name, _, _seconds = _item.partition("=")
+    LOCAL_MAX_AGE[_name.strip()] = float(_seconds)
+
+def _resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+class LocalReplica:
+    """Firebase 를 원본으로 하는 SQLite 복제본에서 읽기
+
+    replica_stamps 에 마지막으로 Firebase 와 일치를 확인한 시각(user_data 는 버전도)을 기록하고,
+    허용 지연 안이면 로컬에서 응답. 읽힌 키는 백그라운드 reconciler 가 주기적으로 다시 맞춤.
+    이 인스턴스의 쓰기가 진행 중이거나 미러에 아직 커밋되지 않은 키는 Firebase 에서 읽음.
+    """
+
+    def __init__(self, enabled, interval):
+        self.enabled = enabled
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._executor = None  # 동기화 전용 풀 - io_pool 의 요청 경로 읽기를 막지 않도록 분리
+        self._hot = OrderedDict()  # (kind, key) -> 마지막 조회 시각
+        self._inflight = {}        # (kind, key) -> 진행 중인 쓰기 수
+        self._barriers = {}        # (kind, key) -> 쓰기 직후 미러 barrier
+        self._written = {}         # (kind, key) -> 쓰기가 끝난 순번
+        self._seq = 0
+        self._hits = 0
+        self._misses = 0
+        self._synced = 0
+        self._errors = 0
+
+    @contextmanager
+    def writing(self, kind, *keys):
+        """Firebase 쓰기 + 미러 기록 구간 - 끝난 뒤 미러에 커밋될 때까지 로컬 읽기 제외"""
+        if not self.enabled:
+            yield
+            return
+        ids = [(kind, key) for key in keys]
+        with self._lock:
+            for i in ids:
+                self._inflight[i] = self._inflight.get(i, 0) + 1
+        try:
+            yield
+        finally:
+            barrier = sqlite_mirror.barrier()
+            with self._lock:
+                self._seq += 1
+                for i in ids:
+                    self._inflight[i] -= 1
+                    if not self._inflight[i]:
+                        del self._inflight[i]
+                    self._barriers[i] = barrier
+                    self._written[i] = self._seq
+
+    def stamp(self, kind, key, version=None):
+        """쓰기로 복제본이 Firebase 와 같아졌음을 기록 (writing 구간 안에서)"""
+        if self.enabled:
+            sqlite_mirror.write(SQL_UPSERT_STAMP, (kind, key, version, time.time()))
+
+    def advance(self, key, version):
+        """부분 갱신 - 직전 버전까지 맞춰져 있던 복제본만 새 버전으로, 아니면 무효화"""
+        if self.enabled:
+            sqlite_mirror.write(SQL_ADVANCE_STAMP, (version, time.time(), "user_data", key, version - 1))
+            sqlite_mirror.write(SQL_DELETE_OTHER_STAMP, ("user_data", key, version))
+
+    def forget(self, kind, key):
+        """Firebase 와 달라진 복제본 (SQLite 에만 쓴 경우)"""
+        if self.enabled:
+            sqlite_mirror.write(SQL_DELETE_STAMP, (kind, key))
+
+    def read(self, kind, key, max_age):
+        """허용 지연 안의 복제본이면 (version, 값), 아니면 _MISSING"""
+        if not self.enabled:
+            return _MISSING
+        i = (kind, key)
+        with self._lock:
+            self._hot[i] = time.monotonic()
+            self._hot.move_to_end(i)
+            if len(self._hot) > LOCAL_HOT_MAX:
+                self._hot.popitem(last=False)
+            busy = i in self._inflight or not sqlite_mirror.committed(self._barriers.get(i))
+        self._ensure_started()
+        if busy:
+            return self._miss()
+
+        try:
+            cur = get_db().cursor()
+            cur.execute(SQL_SELECT_STAMP, i)
+            row = cur.fetchone()
+            if row is None or time.time() - row[1] > max_age:
+                # 처음 보는 키나 오래된 키는 reconciler 가 바로 맞추도록 깨움
+                self._wake.set()
+                return self._miss()
+            version = row[0]
+
+            if kind == "user_data":
+                cur.execute(SQL_SELECT_USER_DATA, (key,))
+                row = cur.fetchone()
+                value = json.loads(row[0]) if row and row[0] else {}
+            elif kind == "friends":
+                cur.execute(SQL_SELECT_FRIENDS, (key,))
+                value = [r[0] for r in cur.fetchall()]
+            else:
+                cur.execute(SQL_SELECT_LOCK, (key,))
+                row = cur.fetchone()
+                value = bool(row[0]) if row else False
+        except Exception as e:
+            print(f"로컬 복제본 읽기 오류: {e}")
+            return self._miss()
+
+        with self._lock:
+            self._hits += 1
+        return version, value
+
+    def _miss(self):
+        with self._lock:
+            self._misses += 1
+        return _MISSING
+
+    def reconcile_once(self):
+        """최근 읽힌 키 중 동기화가 오래된 것을 Firebase 에서 다시 맞춤 - 대상 키 수 반환"""
+        cutoff = time.monotonic() - LOCAL_HOT_WINDOW
+        with self._lock:
+            while self._hot and next(iter(self._hot.values())) < cutoff:
+                self._hot.popitem(last=False)
+            keys = list(reversed(self._hot))[:LOCAL_RECONCILE_BATCH]  # 최근 조회 순
+            for i in [i for i, b in self._barriers.items() if sqlite_mirror.committed(b)]:
+                del self._barriers[i]
+            # token 이후에 끝난 쓰기만 비교 대상 (이전 순번은 필요 없음)
+            self._written.clear()
+            token = self._seq
+
+        cur = get_db().cursor()
+        now = time.time()
+        due = []
+        for i in keys:
+            cur.execute(SQL_SELECT_STAMP, i)
+            row = cur.fetchone()
+            if row is None or now - row[1] >= self.interval:
+                due.append((i, row[0] if row else None))
+
+        futures = [self._executor.submit(self._sync, i, version, token) for i, version in due]
+        for future in futures:
+            future.result()
+        return len(due)
+
+    def _sync(self, i, stamped_version, token):
+        kind, key = i
+        fetched_at = time.time()
+        version = None
+        try:
+            if kind == "user_data":
+                # 버전만 먼저 확인하고, 바뀌었을 때만 컬렉션(버전 포함)을 읽음
+                version = read_user_version(key)
+                ops = []
+                if version != stamped_version:
+                    # 버전과 데이터를 한 번에 읽어 짝을 맞춤
+                    version, data = read_user_collection(key)
+                    ops.append((SQL_SYNC_USER_DATA, (key, json.dumps(data), version)))
+            elif kind == "friends":
+                friend_ids = json.dumps(list((rtdb_get(f'friends/{key}') or {}).keys()))
+                ops = [(SQL_SYNC_FRIENDS_DELETE, (key, friend_ids)), (SQL_SYNC_FRIENDS_INSERT, (key, friend_ids))]
+            else:
+                # Firebase 에 없으면 SQLite 값을 그대로 사용 (기존 조회 방식과 같음)
+                locked = rtdb_get(f'user_locks/{key}')
+                ops = [] if locked is None else [(SQL_UPSERT_LOCK, (key, bool(locked)))]
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            print(f"로컬 복제본 동기화 오류 ({kind}/{key}): {e}")
+            return
+
+        with self._lock:
+            # 읽는 동안 이 인스턴스에서 쓰기가 있었으면 다음 주기에 다시
+            if i in self._inflight or self._written.get(i, 0) > token:
+                return
+            for sql, params in ops:
+                sqlite_mirror.write(sql, params)
+            sqlite_mirror.write(SQL_UPSERT_STAMP, (kind, key, version, fetched_at))
+            self._synced += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "hits": self._hits,
+                "misses": self._misses,
+                "synced": self._synced,
+                "errors": self._errors,
+                "hot_keys": len(self._hot)
+            }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=LOCAL_RECONCILE_WORKERS, thread_name_prefix="local-reconcile"
+                )
+                self._thread = threading.Thread(target=self._run, name="local-reconcile", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.reconcile_once()
+            except Exception as e:
+                print(f"로컬 복제본 동기화 주기 오류: {e}")
+
+local_replica = LocalReplica(LOCAL_FIRST, LOCAL_RECONCILE_INTERVAL)
 
 # ────────────────────────────────────────────
 # UUID 잠금 기능 추가
 # ────────────────────────────────────────────
 
+LOCK_CACHE_SIZE = int(os.environ.get("LOCK_CACHE_SIZE", 10000))
+LOCK_CACHE_TTL = int(os.environ.get("LOCK_CACHE_TTL", 60))  # 초
+LOCK_LISTENER = os.environ.get("LOCK_LISTENER", "0") == "1"  # RTDB 리스너로 캐시 갱신
+
+lock_cache = TTLCache(LOCK_CACHE_SIZE, LOCK_CACHE_TTL)
+
+def _fetch_user_lock(user_id):
+    """캐시를 거치지 않는 잠금 상태 조회 - 오류는 호출 측으로 전달"""
+    local = local_replica.read("user_locks", user_id, LOCAL_MAX_AGE["user_locks"])
+    if local is not _MISSING:
+        return local[1]
+
+    # Firebase에서 먼저 확인
+    lock_status = rtdb_get(f'user_locks/{user_id}')
+    if lock_status is not None:
+        return bool(lock_status)
+
+    # Firebase에 없으면 SQLite에서 확인
+    cur = get_db().cursor()
+    cur.execute(SQL_SELECT_LOCK, (user_id,))
+    row = cur.fetchone()
+    return bool(row[0]) if row else False
+
+def cached_user_lock(user_id):
+    """캐시된 잠금 상태 - 없으면 _MISSING"""
+    return lock_cache.get(user_id, _MISSING)
+
 def is_user_locked(user_id):
     """사용자 잠금 상태 확인"""
+    cached = cached_user_lock(user_id)
+    if cached is not _MISSING:
+        return cached
     try:
-        # Firebase에서 먼저 확인
-        ref = firebase_db.reference(f'user_locks/{user_id}')
-        lock_status = ref.get()
-        if lock_status is not None:
-            return bool(lock_status)
-        
-        # Firebase에 없으면 SQLite에서 확인
-        cur = get_db().cursor()
-        cur.execute("SELECT locked FROM user_locks WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        return bool(row[0]) if row else False
+        locked = _fetch_user_lock(user_id)
+        lock_cache.set(user_id, locked)
+        return locked
     except Exception as e:
         print(f"잠금 상태 확인 오류: {e}")
         return False
 
+def _on_lock_event(event):
+    """user_locks 리스너 콜백 - 변경된 잠금 상태를 캐시에 반영"""
+    if event.path == "/":
+        if event.event_type == "put":
+            lock_cache.clear()
+        for user_id, locked in (event.data or {}).items():
+            if locked is None:
+                lock_cache.discard(user_id)
+            else:
+                lock_cache.set(user_id, bool(locked))
+        return
+
+    user_id = event.path.strip("/").split("/", 1)[0]
+    if event.data is None:
+        lock_cache.discard(user_id)
+    else:
+        lock_cache.set(user_id, bool(event.data))
+
+def start_lock_listener():
+    try:
+        firebase_db.reference("user_locks").listen(_on_lock_event)
+        print("잠금 상태 리스너 시작")
+    except Exception as e:
+        print(f"잠금 상태 리스너 시작 실패: {e}")
+
+if LOCK_LISTENER:
+    start_lock_listener()
+
 def set_user_lock(user_id, locked):
     """사용자 잠금 상태 설정"""
     try:
-        # Firebase에 저장
-        ref = firebase_db.reference(f'user_locks/{user_id}')
-        ref.set(locked)
-        
-        # SQLite에도 백업
-        cur = get_db().cursor()
-        cur.execute(
-            "INSERT INTO user_locks (user_id, locked) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET locked = excluded.locked, locked_at = CURRENT_TIMESTAMP",
-            (user_id, locked)
-        )
-        get_db().commit()
+        with local_replica.writing("user_locks", user_id):
+            # Firebase에 저장
+            ref = firebase_db.reference(f'user_locks/{user_id}')
+            ref.set(locked)
+            rtdb_reader.invalidate(f'user_locks/{user_id}')
+            lock_cache.set(user_id, bool(locked))
+            
+            # SQLite에도 백업 (write-behind)
+            sqlite_mirror.write(
+                SQL_UPSERT_LOCK,
+                (user_id, locked)
+            )
+            local_replica.stamp("user_locks", user_id)
         return True
     except Exception as e:
         print(f"잠금 상태 설정 오류: {e}")
@@ -194,6 +935,37 @@ def get_lock_status(uid):
         print(f"잠금 상태 조회 오류: {e}")
         return jsonify({"error": str(e)}), 500
 
+# ────────────────────────────────────────────
+# RTDB 다중 경로 쓰기 (왕복 1회, 전부 성공 또는 전부 실패)
+# ────────────────────────────────────────────
+
+class RtdbBatch:
+    """여러 경로의 쓰기를 모아 루트에서 update 한 번으로 전송"""
+
+    def __init__(self):
+        self._updates = {}
+
+    def set(self, path, value):
+        path = path.strip("/")
+        for other in self._updates:
+            # 다중 경로 update 는 서로 포함 관계인 경로를 허용하지 않음
+            if path == other or path.startswith(other + "/") or other.startswith(path + "/"):
+                raise ValueError(f"overlapping paths: {path}, {other}")
+        self._updates[path] = value
+        return self
+
+    def __len__(self):
+        return len(self._updates)
+
+    def commit(self):
+        if self._updates:
+            firebase_db.reference("/").update(self._updates)
+            rtdb_reader.invalidate(*self._updates)
+
+def is_valid_key(key):
+    """RTDB 키로 쓸 수 있는 문자열인지"""
+    return isinstance(key, str) and bool(key) and "/" not in key and not (_FORBIDDEN_KEY_CHARS & set(key))
+
 # ────────────────────────────────────────────
 # Friend API (Firebase로 변경)
 # ────────────────────────────────────────────
@@ -207,52 +979,153 @@ def add_friend():
     if not (me and friend):
         return jsonify({"error": "uuid missing"}), 400
     
+    if not (is_valid_key(me) and is_valid_key(friend)):
+        return jsonify({"error": "invalid uuid"}), 400
+    
     try:
-        # Firebase에 친구 관계 저장
-        ref = firebase_db.reference('friends')
-        ref.child(me).child(friend).set(True)
-        ref.child(friend).child(me).set(True)
-        
-        # SQLite에도 백업 (기존 로직 유지)
-        cur = get_db().cursor()
-        cur.execute("INSERT OR IGNORE INTO friends VALUES (?,?)", (me, friend))
-        cur.execute("INSERT OR IGNORE INTO friends VALUES (?,?)", (friend, me))
-        get_db().commit()
+        with local_replica.writing("friends", me, friend):
+            # Firebase에 친구 관계 저장 (양방향을 한 번에)
+            RtdbBatch().set(f'friends/{me}/{friend}', True).set(f'friends/{friend}/{me}', True).commit()
+            
+            # SQLite에도 백업 (write-behind)
+            sqlite_mirror.write(SQL_INSERT_FRIEND, (me, friend))
+            sqlite_mirror.write(SQL_INSERT_FRIEND, (friend, me))
         
         return jsonify({"ok": True})
     except Exception as e:
         print(f"친구 추가 오류: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/friends/batch", methods=["POST"])
+def add_friends_batch():
+    """여러 친구를 한 번에 추가 - {"me": uuid, "friends": [uuid, ...]}"""
+    data = request.get_json(silent=True) or {}
+    me = data.get("me")
+    friends = data.get("friends")
+
+    if not is_valid_key(me) or not isinstance(friends, list):
+        return jsonify({"error": "me and friends required"}), 400
+    if len(friends) > FRIENDS_BATCH_MAX:
+        return jsonify({"error": f"too many friends (max {FRIENDS_BATCH_MAX})"}), 400
+
+    added = []
+    skipped = []
+    batch = RtdbBatch()
+    for friend in friends:
+        if not is_valid_key(friend) or friend == me or friend in added:
+            skipped.append(friend)
+            continue
+        batch.set(f'friends/{me}/{friend}', True).set(f'friends/{friend}/{me}', True)
+        added.append(friend)
+
+    try:
+        with local_replica.writing("friends", me, *added):
+            batch.commit()
+            for friend in added:
+                sqlite_mirror.write(SQL_INSERT_FRIEND, (me, friend))
+                sqlite_mirror.write(SQL_INSERT_FRIEND, (friend, me))
+        return jsonify({"ok": True, "added": added, "skipped": skipped})
+    except Exception as e:
+        print(f"친구 일괄 추가 오류: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/friends/<user_id>", methods=["GET"])
 def list_friends(user_id):
+    local = local_replica.read("friends", user_id, LOCAL_MAX_AGE["friends"])
+    if local is not _MISSING:
+        return jsonify(local[1])
+
     try:
         # Firebase에서 친구 목록 가져오기
-        ref = firebase_db.reference(f'friends/{user_id}')
-        friends_data = ref.get() or {}
+        friends_data = rtdb_get(f'friends/{user_id}') or {}
         friend_list = list(friends_data.keys())
         return jsonify(friend_list)
     except Exception as e:
         # Firebase 실패시 SQLite 백업 사용
         print(f"Firebase 친구목록 오류, SQLite 사용: {e}")
+        sqlite_mirror.flush(timeout=2)  # 대기 중인 미러 쓰기 반영 후 조회
         cur = get_db().cursor()
-        cur.execute("SELECT friend_id FROM friends WHERE user_id = ?", (user_id,))
+        cur.execute(SQL_SELECT_FRIENDS, (user_id,))
         return jsonify([row[0] for row in cur.fetchall()])
 
 @app.route("/api/friend/<friend_id>/collection", methods=["GET"])
 def friend_collection(friend_id):
+    # 본인이 아닌 경우 잠금 상태 확인
+    if request.cookies.get('myUUID') != friend_id and is_user_locked(friend_id):
+        return jsonify({
+            "error": "이 사용자는 데이터를 잠갔습니다",
+            "locked": True
+        }), 403
+
     try:
-        # Firebase에서 친구 컬렉션 가져오기
-        ref = firebase_db.reference(f'users/{friend_id}')
-        data = ref.get() or {}
-        return jsonify({"data": data})
+        # Firebase에서 친구 컬렉션 가져오기 (변경이 없으면 304)
+        version, data = read_collection(friend_id, "friend_collection")
+        if data is None:
+            return not_modified_response(version)
+        return collection_response({"data": present_collection(data)}, version)
     except Exception as e:
         # Firebase 실패시 SQLite 백업 사용
         print(f"Firebase 컬렉션 오류, SQLite 사용: {e}")
+        sqlite_mirror.flush(timeout=2)  # 대기 중인 미러 쓰기 반영 후 조회
         cur = get_db().cursor()
-        cur.execute("SELECT data FROM user_data WHERE user_id = ?", (friend_id,))
+        cur.execute(SQL_SELECT_USER_DATA, (friend_id,))
         row = cur.fetchone()
-        return jsonify({"data": json.loads(row[0]) if row else {}})
+        return jsonify({"data": present_collection(json.loads(row[0]) if row else {})})
+
+FRIENDS_BATCH_MAX = int(os.environ.get("FRIENDS_BATCH_MAX", 200))
+
+def _load_friend_ids(user_id):
+    local = local_replica.read("friends", user_id, LOCAL_MAX_AGE["friends"])
+    if local is not _MISSING:
+        return local[1]
+
+    try:
+        return list((rtdb_get(f'friends/{user_id}') or {}).keys())
+    except Exception as e:
+        print(f"Firebase 친구목록 오류, SQLite 사용: {e}")
+        sqlite_mirror.flush(timeout=2)
+        cur = get_db().cursor()
+        cur.execute(SQL_SELECT_FRIENDS, (user_id,))
+        return [row[0] for row in cur.fetchall()]
+
+@app.route("/api/friends/<user_id>/collections", methods=["GET"])
+def friends_collections(user_id):
+    """친구들의 컬렉션을 한 번에 - 잠금 상태와 데이터를 fanout_pool 에서 동시에 조회"""
+    friend_ids = _load_friend_ids(user_id)[:FRIENDS_BATCH_MAX]
+
+    lock_futures = {}
+    data_futures = {}
+    for fid in friend_ids:
+        if cached_user_lock(fid) is True:
+            lock_futures[fid] = None  # 잠금이 확인된 친구는 데이터를 읽지 않음
+            continue
+        lock_futures[fid] = fanout_pool.submit(is_user_locked, fid)
+        local = local_replica.read("user_data", fid, LOCAL_MAX_AGE["friend_collection"])
+        if local is not _MISSING:
+            data_futures[fid] = _resolved(local[1])
+        else:
+            data_futures[fid] = fanout_pool.submit(rtdb_get, f'users/{fid}')
+
+    collections = {}
+    locked = []
+    errors = {}
+    for fid in friend_ids:
+        lock_future = lock_futures[fid]
+        if lock_future is None or lock_future.result():
+            locked.append(fid)
+            continue
+        try:
+            collections[fid] = present_collection(data_futures[fid].result() or {})
+        except Exception as e:
+            print(f"친구 컬렉션 조회 오류 ({fid}): {e}")
+            errors[fid] = str(e)
+
+    return jsonify({
+        "user_id": user_id,
+        "collections": collections,
+        "locked": locked,
+        "errors": errors
+    })
 
 # ────────────────────────────────────────────
 # User data API (Firebase로 변경 + 잠금 기능 추가)
@@ -268,37 +1141,67 @@ def user_data(uid):
             current_user = request.cookies.get('myUUID')
             
             # 본인이 아닌 경우 잠금 상태 확인
-            if current_user != uid:
-                if is_user_locked(uid):
-                    return jsonify({
-                        "error": "이 사용자는 데이터를 잠갔습니다",
-                        "locked": True
-                    }), 403
+            locked = False if current_user == uid else cached_user_lock(uid)
+            if locked is not True:
+                # 버전/데이터 조회를 먼저 시작해 두고 잠금 상태 확인과 겹쳐서 진행
+                pending = start_collection_read(uid)
+                if locked is _MISSING:
+                    locked = is_user_locked(uid)
+            if locked:
+                return jsonify({
+                    "error": "이 사용자는 데이터를 잠갔습니다",
+                    "locked": True
+                }), 403
             
             # Firebase에서 데이터 가져오기
-            data = ref.get() or {}
-            return jsonify({"user_id": uid, "data": json.dumps(data)})
+            version, data = finish_collection_read(pending)
+            if data is None:
+                return not_modified_response(version)
+            data = present_collection(data)
+            # ?format=object 이면 문자열이 아닌 JSON 객체로 응답
+            if request.args.get("format") != "object":
+                data = json.dumps(data)
+            return collection_response({"user_id": uid, "data": data, "version": version}, version)
         
         # POST - update (본인만 가능하므로 잠금 체크 불필요)
-        new_data = request.json.get("data")
-        
-        # Firebase에 저장
-        ref.set(new_data)
+        expected = request.json.get("version")
+        if expected is not None and not isinstance(expected, int):
+            return jsonify({"error": "version must be an integer"}), 400
+        try:
+            # 클라이언트가 보낸 버전 키는 무시 (버전은 서버가 관리)
+            new_data = prepare_for_storage(split_user_version(request.json.get("data"))[1]) or {}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if not isinstance(new_data, dict):
+            return jsonify({"error": "data must be an object"}), 400
         
-        # SQLite에도 백업
-        cur = get_db().cursor()
-        cur.execute(
-            "INSERT INTO user_data (user_id, data) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
-            (uid, json.dumps(new_data)),
-        )
-        get_db().commit()
+        with local_replica.writing("user_data", uid):
+            # 연결 확인을 겸한 첫 읽기 - 실패하면 아래 SQLite 대체 경로로
+            legacy = legacy_user_version(uid)
+            try:
+                # Firebase에 저장 - 버전 비교와 쓰기를 한 트랜잭션으로
+                version, new_data = write_user_collection(uid, expected, lambda current: new_data, legacy)
+            except StaleVersionError as e:
+                return jsonify({"error": "stale version", "version": e.current}), 409
+            except firebase_db.TransactionAbortedError:
+                return jsonify({"error": "concurrent update, retry"}), 409
+            except Exception as e:
+                # Firebase 에 연결된 뒤의 실패는 SQLite 로 대신하지 않음
+                print(f"Firebase 사용자 데이터 저장 오류: {e}")
+                return jsonify({"error": str(e)}), 500
+            
+            # SQLite에도 백업 (write-behind)
+            sqlite_mirror.write(
+                SQL_UPSERT_USER_DATA,
+                (uid, json.dumps(new_data), version),
+            )
+            local_replica.stamp("user_data", uid, version)
         
-        return jsonify({"ok": True})
+        return jsonify({"ok": True, "version": version})
         
     except Exception as e:
         print(f"Firebase 사용자 데이터 오류: {e}")
         # Firebase 실패시 SQLite만 사용
-        cur = get_db().cursor()
         if request.method == "GET":
             # 본인이 아닌 경우 잠금 상태 확인
             current_user = request.cookies.get('myUUID')
@@ -308,89 +1211,1029 @@ def user_data(uid):
                     "locked": True
                 }), 403
             
-            cur.execute("SELECT data FROM user_data WHERE user_id = ?", (uid,))
+            sqlite_mirror.flush(timeout=2)  # 대기 중인 미러 쓰기 반영 후 조회
+            cur = get_db().cursor()
+            cur.execute(SQL_SELECT_USER_DATA, (uid,))
             row = cur.fetchone()
-            return jsonify({"user_id": uid, "data": row[0] if row else "{}"})
+            data = present_collection(json.loads(row[0]) if row else {})
+            if request.args.get("format") != "object":
+                data = json.dumps(data)
+            return jsonify({"user_id": uid, "data": data})
         else:
-            new_data = request.json.get("data")
-            cur.execute(
-                "INSERT INTO user_data (user_id, data) VALUES (?, ?) ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
-                (uid, json.dumps(new_data)),
-            )
-            get_db().commit()
+            # SQLite 가 유일한 저장소이므로 커밋까지 기다림
+            try:
+                new_data = prepare_for_storage(request.json.get("data"))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            with local_replica.writing("user_data", uid):
+                sqlite_mirror.write(
+                    SQL_UPSERT_USER_DATA,
+                    (uid, json.dumps(new_data), None),
+                    wait=True
+                )
+                local_replica.forget("user_data", uid)
             return jsonify({"ok": True})
 
+# ────────────────────────────────────────────
+# 컬렉션 부분 갱신 (PATCH) + 버전 관리
+# ────────────────────────────────────────────
+
+PATCH_MAX_CHANGES = 500
+_FORBIDDEN_KEY_CHARS = set('.$#[]"')
+
+class StaleVersionError(Exception):
+    """요청한 버전이 저장된 버전과 다를 때"""
+
+    def __init__(self, current):
+        super().__init__(f"stale version (current {current})")
+        self.current = current
+
+# 버전은 users/<uid> 안에 함께 저장 - 버전 비교와 데이터 쓰기가 한 번의 트랜잭션(조건부 쓰기)으로 이루어짐
+# user_versions/<uid> 는 이전 방식으로 저장된 버전 (노드에 버전이 없을 때만 사용)
+USER_VERSION_KEY = "_version"
+
+def split_user_version(node):
+    """users/<uid> 노드 -> (노드에 저장된 버전 또는 None, 버전을 뺀 컬렉션)"""
+    if not isinstance(node, dict) or USER_VERSION_KEY not in node:
+        return None, node
+    data = dict(node)
+    return data.pop(USER_VERSION_KEY), data
+
+def legacy_user_version(uid):
+    """이전 방식의 버전 - 쓰기 전에 항상 읽음 (여기서 실패하면 Firebase 에 연결되지 않은 것으로 보고 SQLite 로 대신함)"""
+    return firebase_db.reference(f'user_versions/{uid}').get() or 0
+
+def write_user_collection(uid, expected, build, legacy):
+    """users/<uid> 를 트랜잭션으로 갱신 - build(현재 컬렉션) 가 새 컬렉션(dict)을 반환
+
+    expected 가 주어졌는데 저장된 버전과 다르면 StaleVersionError (동시 쓰기는 트랜잭션이 다시 시도하며 확인).
+    legacy: 노드에 버전이 없을 때 쓸 legacy_user_version(uid) 값. 반환값: (새 버전, 새 컬렉션)
+    """
+    def update(node):
+        stored, data = split_user_version(node)
+        current = legacy if stored is None else stored
+        if expected is not None and current != expected:
+            raise StaleVersionError(current)
+        return {**build(data or {}), USER_VERSION_KEY: current + 1}
+
+    try:
+        node = firebase_db.reference(f'users/{uid}').transaction(update)
+    finally:
+        rtdb_reader.invalidate(f'users/{uid}')
+    return split_user_version(node)
+
+def read_user_version(uid):
+    version = rtdb_get(f'users/{uid}/{USER_VERSION_KEY}')
+    return version if version is not None else (rtdb_get(f'user_versions/{uid}') or 0)
+
+def read_user_collection(uid):
+    """(version, data) - 버전이 노드 안에 있으므로 한 번의 읽기로 짝이 맞음"""
+    version, data = split_user_version(rtdb_get(f'users/{uid}'))
+    if version is None:
+        version = rtdb_get(f'user_versions/{uid}') or 0
+    return version, data or {}
+
+def _collection_etag(version):
+    """버전 + 응답 표현 - 같은 URL 이라도 format/encoding 이 다르면 본문이 다름"""
+    fmt = "object" if request.args.get("format") == "object" else "string"
+    encoding = "compact" if request.args.get("encoding") == "compact" else "full"
+    return f"v{version}-{fmt}-{encoding}"
+
+def start_collection_read(uid, endpoint="user_data"):
+    """If-None-Match 가 있으면 버전만, 없으면 버전이 들어 있는 컬렉션 전체를 미리 조회"""
+    local = local_replica.read("user_data", uid, LOCAL_MAX_AGE[endpoint])
+    if local is not _MISSING:
+        return uid, _resolved((local[0] or 0, local[1])), True
+    if request.if_none_match:
+        return uid, io_pool.submit(read_user_version, uid), False
+    return uid, io_pool.submit(read_user_collection, uid), True
+
+def finish_collection_read(pending):
+    """(version, data) 반환 - 클라이언트 ETag 와 같으면 data 는 None (데이터 조회 생략)"""
+    uid, future, with_data = pending
+    version, data = future.result() if with_data else (future.result(), _MISSING)
+    if request.if_none_match and request.if_none_match.contains_weak(_collection_etag(version)):
+        return version, None
+    if data is _MISSING:
+        version, data = read_user_collection(uid)
+    return version, data
+
+def read_collection(uid, endpoint="user_data"):
+    return finish_collection_read(start_collection_read(uid, endpoint))
+
+def collection_response(body, version):
+    resp = jsonify(body)
+    resp.set_etag(_collection_etag(version))
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def not_modified_response(version):
+    resp = app.response_class(status=304)
+    resp.set_etag(_collection_etag(version))
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def parse_card_path(path):
+    """'a/b' 형태의 카드 경로 검증 - 잘못되면 ValueError"""
+    parts = str(path).strip("/").split("/")
+    if not all(parts) or any(_FORBIDDEN_KEY_CHARS & set(p) for p in parts):
+        raise ValueError(f"invalid path: {path}")
+    return parts
+
+def _json_path(parts):
+    return "$" + "".join(f'."{p}"' for p in parts)
+
+def mirror_card_changes(uid, changes, version, wait=False):
+    """변경된 카드만 SQLite 미러에 반영"""
+    ops = [(SQL_ENSURE_USER, (uid,))]
+    for parts, value in changes.items():
+        if value is None:
+            ops.append((SQL_REMOVE_USER_CARD, (_json_path(parts), version, uid)))
+            # 깊은 곳부터 비게 된 상위 노드 정리 - apply_card_changes 와 같은 결과
+            for depth in range(len(parts) - 1, 0, -1):
+                path = _json_path(parts[:depth])
+                ops.append((SQL_PRUNE_EMPTY_NODE, (path, uid, path)))
+        else:
+            ops.append((SQL_SET_USER_CARD, (_json_path(parts), json.dumps(value), version, uid)))
+    for i, (sql, params) in enumerate(ops):
+        sqlite_mirror.write(sql, params, wait=wait and i == len(ops) - 1)
+
+@app.route("/api/user/<uid>", methods=["PATCH"])
+def patch_user_data(uid):
+    """변경된 카드 경로만 반영 - {"changes": {"경로": 값 또는 null}, "version": n}"""
+    body = request.get_json(silent=True) or {}
+    changes = body.get("changes")
+    expected = body.get("version")
+
+    if not isinstance(changes, dict) or not changes:
+        return jsonify({"error": "changes required"}), 400
+    if len(changes) > PATCH_MAX_CHANGES:
+        return jsonify({"error": f"too many changes (max {PATCH_MAX_CHANGES})"}), 400
+    if expected is not None and not isinstance(expected, int):
+        return jsonify({"error": "version must be an integer"}), 400
+
+    try:
+        parsed = {tuple(parse_card_path(path)): value for path, value in changes.items()}
+        # 서로 포함 관계인 경로({"a": .., "a/b": ..})는 RTDB 가 거부하므로 미리 400
+        batch = RtdbBatch()
+        for parts, value in parsed.items():
+            if parts[0] == USER_VERSION_KEY:
+                raise ValueError(f"invalid path: {'/'.join(parts)}")
+            batch.set("/".join(parts), value)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def apply(current):
+        if is_compact(current):
+            return encode_collection(apply_card_changes(decode_collection(current), parsed))
+        return apply_card_changes(current, parsed)
+
+    try:
+        with local_replica.writing("user_data", uid):
+            # 연결 확인을 겸한 첫 읽기 - 실패하면 아래 SQLite 대체 경로로
+            legacy = legacy_user_version(uid)
+            try:
+                # 버전 비교와 변경 적용을 한 트랜잭션으로 - 그 사이에 다른 쓰기가 끼어들면 다시 시도
+                version, stored = write_user_collection(uid, expected, apply, legacy)
+            except StaleVersionError as e:
+                return jsonify({"error": "stale version", "version": e.current}), 409
+            except firebase_db.TransactionAbortedError:
+                return jsonify({"error": "concurrent update, retry"}), 409
+            except Exception as e:
+                # Firebase 에 연결된 뒤의 실패는 SQLite 로 대신하지 않음
+                print(f"Firebase 부분 갱신 오류: {e}")
+                return jsonify({"error": str(e)}), 500
+
+            if is_compact(stored):
+                sqlite_mirror.write(SQL_UPSERT_USER_DATA, (uid, json.dumps(stored), version))
+                local_replica.stamp("user_data", uid, version)
+            else:
+                mirror_card_changes(uid, parsed, version)
+                local_replica.advance(uid, version)
+        return jsonify({"ok": True, "version": version})
+
+    except Exception as e:
+        print(f"Firebase 부분 갱신 오류, SQLite만 사용: {e}")
+        # Firebase 실패시 SQLite만 사용 - 커밋까지 기다림
+        sqlite_mirror.flush(timeout=2)
+        row = get_db().execute(SQL_SELECT_USER_DATA, (uid,)).fetchone()
+        current = json.loads(row[0]) if row and row[0] else {}
+        with local_replica.writing("user_data", uid):
+            if is_compact(current):
+                stored = encode_collection(apply_card_changes(decode_collection(current), parsed))
+                sqlite_mirror.write(SQL_UPSERT_USER_DATA, (uid, json.dumps(stored), None), wait=True)
+            else:
+                mirror_card_changes(uid, parsed, None, wait=True)
+            local_replica.forget("user_data", uid)
+        return jsonify({"ok": True})
+
+# ────────────────────────────────────────────
+# 컬렉션 압축 인코딩 (unique_id 비트셋)
+# ────────────────────────────────────────────
+
+# 압축형 예시: {"fmt": "bits1", "sets": [{"value": true, "base": 351631, "bits": "..."}], "extra": {...}}
+# - unique_id 키는 값별로 묶어 base 부터의 비트셋(bits) 또는 구간 목록(runs)으로 저장
+# - unique_id 가 아닌 키나 dict 값은 extra 에 그대로 보관 (손실 없음)
+COMPACT_FORMAT = "bits1"
+COMPACT_COLLECTIONS = os.environ.get("COMPACT_COLLECTIONS", "0") == "1"  # 일반 dict 저장 시 자동 압축
+COMPACT_MAX_CARDS = int(os.environ.get("COMPACT_MAX_CARDS", 100000))  # 압축형 하나에서 복원할 unique_id 최대 개수
+
+def is_compact(data):
+    return isinstance(data, dict) and data.get("fmt") == COMPACT_FORMAT
+
+def _is_uid_key(key):
+    return key.isdigit() and key.isascii() and (key == "0" or not key.startswith("0"))
+
+def _write_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varints(raw):
+    n = shift = 0
+    for byte in raw:
+        n |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield n
+            n = shift = 0
+    if shift:
+        raise ValueError("truncated varint")
+
+def _b64(raw):
+    return base64.b64encode(bytes(raw)).decode("ascii")
+
+def _encode_uid_set(uids):
+    """정렬된 unique_id 목록 -> 비트셋/구간 중 짧은 쪽"""
+    base = uids[0]
+    bits = bytearray((uids[-1] - base) // 8 + 1)
+    for uid in uids:
+        offset = uid - base
+        bits[offset >> 3] |= 1 << (offset & 7)
+
+    # 구간: (이전 구간 끝에서의 간격, 길이) 쌍을 varint 로
+    runs = bytearray()
+    prev_end = base
+    start = prev = uids[0]
+    for uid in uids[1:] + [None]:
+        if uid is not None and uid == prev + 1:
+            prev = uid
+            continue
+        _write_varint(runs, start - prev_end)
+        _write_varint(runs, prev - start + 1)
+        prev_end = prev + 1
+        if uid is not None:
+            start = prev = uid
+
+    if len(runs) < len(bits):
+        return {"base": base, "runs": _b64(runs)}
+    return {"base": base, "bits": _b64(bits)}
+
+def _decode_uid_set(entry, limit):
+    """압축된 unique_id 집합 복원 - limit 개를 넘으면 펼치기 전에 ValueError"""
+    base = int(entry["base"])
+    if base < 0:
+        raise ValueError("negative base")
+    if "bits" in entry:
+        bits = base64.b64decode(entry["bits"])
+        if sum(bin(byte).count("1") for byte in bits) > limit:
+            raise ValueError(f"too many cards (max {COMPACT_MAX_CARDS})")
+        return [base + (i << 3) + j for i, byte in enumerate(bits) for j in range(8) if byte >> j & 1]
+    values = list(_read_varints(base64.b64decode(entry["runs"])))
+    if len(values) % 2:
+        raise ValueError("invalid runs")
+    gaps, lengths = values[::2], values[1::2]
+    if sum(lengths) > limit:
+        raise ValueError(f"too many cards (max {COMPACT_MAX_CARDS})")
+    if any(gap > COMPACT_MAX_CARDS for gap in gaps):
+        raise ValueError("invalid runs")
+    uids = []
+    pos = base
+    for gap, length in zip(gaps, lengths):
+        start = pos + gap
+        uids.extend(range(start, start + length))
+        pos = start + length
+    return uids
+
+def encode_collection(data):
+    """일반 컬렉션 dict -> 압축형 (decode_collection 으로 그대로 복원됨)"""
+    groups = {}  # 값(JSON 문자열) -> [unique_id]
+    extra = {}
+    for key, value in (data or {}).items():
+        if _is_uid_key(key) and isinstance(value, (bool, int, float, str)):
+            groups.setdefault(json.dumps(value), []).append(int(key))
+        else:
+            extra[key] = value
+
+    sets = []
+    for value, uids in groups.items():
+        uids.sort()
+        # 간격이 COMPACT_MAX_CARDS 보다 크면 새 base 로 나눔 (복원 시 큰 간격은 거부하므로)
+        start = 0
+        for i in range(1, len(uids) + 1):
+            if i < len(uids) and uids[i] - uids[i - 1] <= COMPACT_MAX_CARDS:
+                continue
+            entry = _encode_uid_set(uids[start:i])
+            entry["value"] = json.loads(value)
+            sets.append(entry)
+            start = i
+
+    compact = {"fmt": COMPACT_FORMAT, "sets": sets}
+    if extra:
+        compact["extra"] = extra
+    return compact
+
+def decode_collection(compact):
+    """압축형 -> 일반 dict - 형식이 잘못되면 ValueError"""
+    try:
+        data = dict(compact.get("extra") or {})
+        sets = compact.get("sets") or []
+        # RTDB 는 배열을 {"0": ..} 형태로 돌려줄 수 있음
+        if isinstance(sets, dict):
+            sets = list(sets.values())
+        remaining = COMPACT_MAX_CARDS
+        for entry in sets:
+            value = entry["value"]
+            uids = _decode_uid_set(entry, remaining)
+            remaining -= len(uids)
+            for uid in uids:
+                data[str(uid)] = value
+        return data
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError(f"invalid compact collection: {e}")
+
+def expand_collection(data):
+    data = split_user_version(data)[1]
+    return decode_collection(data) if is_compact(data) else (data or {})
+
+def present_collection(data):
+    """?encoding=compact 요청이면 압축형, 아니면 일반 dict 로"""
+    data = split_user_version(data)[1]
+    if request.args.get("encoding") == "compact":
+        return data if is_compact(data) else encode_collection(data)
+    return expand_collection(data)
+
+def prepare_for_storage(data):
+    """저장할 형태 결정 - 압축형 입력은 검증 후 그대로, 일반 dict 는 설정에 따라 압축"""
+    if is_compact(data):
+        decode_collection(data)
+        return data
+    if COMPACT_COLLECTIONS and isinstance(data, dict) and data:
+        compact = encode_collection(data)
+        if len(json.dumps(compact)) < len(json.dumps(data)):
+            return compact
+    return data
+
+def apply_card_changes(data, changes):
+    """{경로 parts: 값 또는 None} 을 dict 에 적용 (RTDB update 와 같은 의미)"""
+    data = dict(data)
+    for parts, value in changes.items():
+        node = data
+        trail = []
+        for part in parts[:-1]:
+            child = node.get(part)
+            child = dict(child) if isinstance(child, dict) else {}
+            node[part] = child
+            trail.append((node, part))
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+            # 비게 된 상위 노드는 제거 (RTDB 는 빈 노드를 저장하지 않음)
+            for parent, key in reversed(trail):
+                if parent[key]:
+                    break
+                del parent[key]
+        else:
+            node[parts[-1]] = value
+    return data
+
+# ────────────────────────────────────────────
+# 트레이드 매칭 (친구와 보유/희망 카드 교차)
+# ────────────────────────────────────────────
+
+MATCH_MAX_FRIENDS = int(os.environ.get("MATCH_MAX_FRIENDS", 500))
+MATCH_LIST_LIMIT = 100  # 친구별로 돌려줄 카드 id 최대 개수
+HAVE_VALUES = {"have", "owned", "own"}
+WANT_VALUES = {"want", "wanted", "wish"}
+
+def card_status(value):
+    """컬렉션 값 -> (보유, 희망)"""
+    if isinstance(value, dict):
+        return bool(value.get("have") or value.get("owned")), bool(value.get("want"))
+    if isinstance(value, str):
+        value = value.lower()
+        return value in HAVE_VALUES, value in WANT_VALUES
+    if isinstance(value, bool):
+        return value, False
+    if isinstance(value, (int, float)):
+        return value > 0, False
+    return False, False
+
+class CardProfile:
+    """카탈로그 위치 기준 비트마스크 - have: 보유, need: 희망(없으면 미보유 전체)"""
+
+    def __init__(self, data, snapshot):
+        have = want = 0
+        for key, value in expand_collection(data).items():
+            pos = snapshot.uid_positions.get(key)
+            if pos is None:
+                continue
+            owned, wanted = card_status(value)
+            if owned:
+                have |= 1 << pos
+            if wanted:
+                want |= 1 << pos
+        self.have = have
+        self.need = want or (snapshot.all_mask & ~have)
+
+def _mask_uids(mask, snapshot, limit):
+    uids = []
+    while mask and len(uids) < limit:
+        low = mask & -mask  # 가장 낮은 비트
+        uids.append(snapshot.position_uids[low.bit_length() - 1])
+        mask ^= low
+    return uids
+
+def _popcount(mask):
+    return bin(mask).count("1")
+
+# (uid, version, 카탈로그) -> CardProfile, uid -> (버전 키, 결과)
+profile_cache = TTLCache(5000, 3600)
+match_cache = TTLCache(2000, 3600)
+
+def compute_matches(uid, friend_ids, snapshot):
+    ids = [uid] + friend_ids
+    version_futures = {i: fanout_pool.submit(read_user_version, i) for i in ids}
+    lock_futures = {f: fanout_pool.submit(is_user_locked, f) for f in friend_ids}
+    versions = {i: f.result() for i, f in version_futures.items()}
+    visible = [f for f in friend_ids if not lock_futures[f].result()]
+
+    # 관련된 컬렉션 버전이 모두 그대로면 이전 결과 재사용
+    cache_key = (snapshot.serial, versions[uid], tuple((f, versions[f]) for f in visible))
+    cached = match_cache.get(uid)
+    if cached is not None and cached[0] == cache_key:
+        return cached[1], True
+
+    profiles = {}
+    data_futures = {}
+    for i in [uid] + visible:
+        profile = profile_cache.get((i, versions[i], snapshot.serial))
+        if profile is not None:
+            profiles[i] = profile
+        else:
+            data_futures[i] = fanout_pool.submit(rtdb_get, f'users/{i}')
+    for i, future in data_futures.items():
+        profiles[i] = CardProfile(future.result(), snapshot)
+        profile_cache.set((i, versions[i], snapshot.serial), profiles[i])
+
+    me = profiles[uid]
+    matches = []
+    for fid in visible:
+        friend = profiles[fid]
+        they_have = friend.have & me.need
+        they_need = me.have & friend.need
+        count = _popcount(they_have) + _popcount(they_need)
+        if not count:
+            continue
+        matches.append({
+            "friend_id": fid,
+            "count": count,
+            "mutual": bool(they_have and they_need),
+            "they_have_you_want": _mask_uids(they_have, snapshot, MATCH_LIST_LIMIT),
+            "you_have_they_want": _mask_uids(they_need, snapshot, MATCH_LIST_LIMIT),
+        })
+    # 서로 교환 가능한 친구 우선, 그다음 매칭 수
+    matches.sort(key=lambda m: (m["mutual"], m["count"]), reverse=True)
+
+    match_cache.set(uid, (cache_key, matches))
+    return matches, False
+
+@app.route("/api/user/<uid>/matches", methods=["GET"])
+def user_matches(uid):
+    """친구 중 내가 원하는 카드를 가진 사람 / 내 카드가 필요한 사람"""
+    # 응답에 본인 보유 카드가 들어가므로 본인만 조회 가능 (잠금 우회 방지)
+    if request.cookies.get('myUUID') != uid:
+        return jsonify({"error": "본인만 조회할 수 있습니다"}), 403
+
+    try:
+        snapshot = image_catalog.get()
+        friend_ids = _load_friend_ids(uid)[:MATCH_MAX_FRIENDS]
+        matches, cached = compute_matches(uid, friend_ids, snapshot)
+        return jsonify({"user_id": uid, "matches": matches, "cached": cached})
+    except Exception as e:
+        print(f"트레이드 매칭 오류: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/register", methods=["POST"])
 def register():
     new_uuid = str(uuid.uuid4())
     
     try:
-        # Firebase에 새 사용자 등록
-        ref = firebase_db.reference(f'users/{new_uuid}')
-        ref.set({})
-        
-        # 기본 잠금 상태 설정 (잠금 해제 상태)
-        set_user_lock(new_uuid, False)
-        
-        # SQLite에도 백업
-        cur = get_db().cursor()
-        cur.execute("INSERT INTO user_data (user_id, data) VALUES (?, '{}')", (new_uuid,))
-        get_db().commit()
+        with local_replica.writing("user_data", new_uuid), local_replica.writing("user_locks", new_uuid):
+            # Firebase에 새 사용자 등록 + 기본 잠금 상태(해제)를 한 번에
+            RtdbBatch().set(f'users/{new_uuid}', {}).set(f'user_locks/{new_uuid}', False).commit()
+            lock_cache.set(new_uuid, False)
+            
+            # SQLite에도 백업 (write-behind)
+            sqlite_mirror.write(SQL_INSERT_EMPTY_USER, (new_uuid,))
+            sqlite_mirror.write(SQL_UPSERT_LOCK, (new_uuid, False))
+            local_replica.stamp("user_data", new_uuid, 0)
+            local_replica.stamp("user_locks", new_uuid)
         
     except Exception as e:
         print(f"Firebase 사용자 등록 오류, SQLite만 사용: {e}")
-        # Firebase 실패시 SQLite만 사용
-        cur = get_db().cursor()
-        cur.execute("INSERT INTO user_data (user_id, data) VALUES (?, '{}')", (new_uuid,))
-        get_db().commit()
+        # Firebase 실패시 SQLite만 사용 - 커밋까지 기다림
+        sqlite_mirror.write(SQL_INSERT_EMPTY_USER, (new_uuid,), wait=True)
     
     resp = jsonify({"user_id": new_uuid})
     resp.set_cookie("myUUID", new_uuid, max_age=31536000, httponly=True, secure=True, samesite="None")
     return resp
 
+# ────────────────────────────────────────────
+# 친구 변경 알림 (Server-Sent Events)
+# ────────────────────────────────────────────
+
+SSE_HEARTBEAT = int(os.environ.get("SSE_HEARTBEAT", 15))      # 초
+SSE_QUEUE_SIZE = int(os.environ.get("SSE_QUEUE_SIZE", 100))   # 구독자별 대기 이벤트 최대 개수
+SSE_MAX_FRIENDS = int(os.environ.get("SSE_MAX_FRIENDS", 100))
+SSE_MAX_CLIENTS = int(os.environ.get("SSE_MAX_CLIENTS", 200))
+
+class ChangeSubscriber:
+    """SSE 연결 하나 - 큐가 가득 차면(느린 클라이언트) overflow 로 표시하고 재동기화 요청"""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflow = False
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflow = True
+
+class _Watch:
+    def __init__(self):
+        self.subscribers = set()
+        self.registration = None
+        self.state = None    # users: 일반 dict 컬렉션, user_locks: bool
+        self.primed = False  # 첫 이벤트(현재 값 전체)를 받았는지
+        self.compact = False
+
+class ChangeHub:
+    """경로마다 RTDB 리스너 하나를 두고 모든 구독자에게 변경분을 나눠 줌
+
+    listen(path, callback) 은 close() 를 가진 객체를, read(path) 는 현재 값을 반환해야 함
+    (둘 다 firebase_db 대신 메모리 구현으로 바꿀 수 있음).
+    """
+
+    def __init__(self, listen, read):
+        self._listen = listen
+        self._read = read
+        self._lock = threading.Lock()
+        self._watches = {}
+
+    @staticmethod
+    def _paths(friend_ids):
+        for fid in friend_ids:
+            yield f"user_locks/{fid}"
+            yield f"users/{fid}"
+
+    def subscribe(self, friend_ids, subscriber):
+        started = []
+        with self._lock:
+            for path in self._paths(friend_ids):
+                watch = self._watches.get(path)
+                if watch is None:
+                    watch = self._watches[path] = _Watch()
+                    started.append((path, watch))
+                watch.subscribers.add(subscriber)
+
+        # 리스너 콜백이 바로 호출될 수 있으므로 잠금 밖에서 시작
+        for path, watch in started:
+            registration = self._listen(path, lambda event, path=path: self._on_event(path, event))
+            with self._lock:
+                watch.registration = registration
+                orphaned = self._watches.get(path) is not watch
+            if orphaned:
+                registration.close()
+
+    def unsubscribe(self, friend_ids, subscriber):
+        closing = []
+        with self._lock:
+            for path in self._paths(friend_ids):
+                watch = self._watches.get(path)
+                if watch is None:
+                    continue
+                watch.subscribers.discard(subscriber)
+                if not watch.subscribers:
+                    del self._watches[path]
+                    if watch.registration is not None:
+                        closing.append(watch.registration)
+        # 마지막 구독자가 떠난 경로의 리스너 정리
+        for registration in closing:
+            try:
+                registration.close()
+            except Exception as e:
+                print(f"리스너 종료 오류: {e}")
+
+    def watched_paths(self):
+        with self._lock:
+            return len(self._watches)
+
+    def _on_event(self, path, event):
+        kind, fid = path.split("/", 1)
+        rtdb_reader.invalidate(path)
+        try:
+            if kind == "user_locks":
+                self._on_lock_event(path, fid, event)
+            else:
+                self._on_collection_event(path, fid, event)
+        except Exception as e:
+            print(f"변경 알림 처리 오류 ({path}): {e}")
+
+    def _on_lock_event(self, path, fid, event):
+        locked = bool(event.data)
+        lock_cache.set(fid, locked)
+        with self._lock:
+            watch = self._watches.get(path)
+            if watch is None:
+                return
+            changed = watch.primed and watch.state != locked
+            watch.state, watch.primed = locked, True
+            subscribers = list(watch.subscribers)
+        if changed:
+            for subscriber in subscribers:
+                subscriber.offer({"type": "lock", "friend_id": fid, "locked": locked})
+
+    def _on_collection_event(self, path, fid, event):
+        with self._lock:
+            watch = self._watches.get(path)
+            compact = watch is not None and watch.compact
+        if watch is None:
+            return
+
+        event_path = event.path.strip("/")
+        replaced = False
+        if not event_path and event.event_type == "put":
+            # 루트 put 은 전체 교체 - None 이면 컬렉션이 삭제된 것
+            replaced, fresh = True, event.data or {}
+        elif compact:
+            # 압축 저장된 컬렉션은 부분 이벤트로 해석할 수 없으므로 다시 읽음 (크기가 작음)
+            replaced, fresh = True, self._read(path) or {}
+
+        with self._lock:
+            if self._watches.get(path) is not watch:
+                return
+            old = watch.state or {}
+            if replaced:
+                watch.compact = is_compact(fresh)
+                new = expand_collection(fresh)
+                keys = set(old) | set(new)
+                changed = sorted(k for k in keys if old.get(k) != new.get(k))
+            else:
+                parts = event_path.split("/")
+                if event.event_type == "patch":
+                    changes = {tuple(parts + k.split("/")) if event_path else tuple(k.split("/")): v
+                               for k, v in (event.data or {}).items()}
+                else:
+                    changes = {tuple(parts): event.data}
+                # 노드에 함께 저장된 버전은 카드가 아님
+                changes = {p: v for p, v in changes.items() if p[0] != USER_VERSION_KEY}
+                new = apply_card_changes(old, changes)
+                changed = sorted({p[0] for p in changes})
+
+            primed = watch.primed
+            watch.state, watch.primed = new, True
+            subscribers = list(watch.subscribers)
+            lock_watch = self._watches.get(f"user_locks/{fid}")
+            locked = lock_watch is None or bool(lock_watch.state)
+
+        # 처음 받은 현재 값은 알리지 않고, 잠긴 친구의 변경 내용은 보내지 않음
+        if not primed or not changed or locked:
+            return
+        payload = {"type": "collection", "friend_id": fid, "changed": {k: new.get(k) for k in changed}}
+        for subscriber in subscribers:
+            subscriber.offer(payload)
+
+change_hub = ChangeHub(
+    lambda path, callback: firebase_db.reference(path).listen(callback),
+    lambda path: firebase_db.reference(path).get()
+)
+_sse_clients = threading.BoundedSemaphore(SSE_MAX_CLIENTS)
+
+@app.route("/api/friends/<user_id>/events", methods=["GET"])
+def friend_events(user_id):
+    """친구 컬렉션 변경(바뀐 카드 키)과 잠금 상태 변화를 SSE 로 전달"""
+    if not _sse_clients.acquire(blocking=False):
+        return jsonify({"error": "too many event streams"}), 503
+
+    try:
+        friend_ids = _load_friend_ids(user_id)[:SSE_MAX_FRIENDS]
+        subscriber = ChangeSubscriber(SSE_QUEUE_SIZE)
+        change_hub.subscribe(friend_ids, subscriber)
+    except Exception as e:
+        _sse_clients.release()
+        print(f"변경 알림 구독 오류: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                if subscriber.overflow:
+                    # 이벤트를 놓쳤으므로 클라이언트가 전체를 다시 읽도록 알리고 종료
+                    yield "event: resync\ndata: {}\n\n"
+                    return
+                try:
+                    event = subscriber.queue.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            change_hub.unsubscribe(friend_ids, subscriber)
+            _sse_clients.release()
+
+    return app.response_class(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # 프록시 버퍼링 방지
+    })
+
+# ────────────────────────────────────────────
+# 이미지 카탈로그 캐시 (버킷 목록을 한 번만 파싱)
+# ────────────────────────────────────────────
+
+CATALOG_TTL = int(os.environ.get("CATALOG_TTL", 300))  # 초 단위 갱신 주기
+# 업로드 스크립트가 올린 매니페스트(catalog/manifest.json.gz)로 카탈로그 구성 - 목록 조회 없음
+CATALOG_MANIFEST = os.environ.get("CATALOG_MANIFEST", "1") == "1"
+CATALOG_MANIFEST_POLL = int(os.environ.get("CATALOG_MANIFEST_POLL", 30))  # 매니페스트 버전 확인 주기 (초)
+# 배포에 함께 포함한 매니페스트 - 기동 직후 첫 요청부터 바로 응답
+CATALOG_MANIFEST_FILE = os.environ.get(
+    "CATALOG_MANIFEST_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "catalog_manifest.json.gz")
+)
+# 관리자 전용 필드 - 공개 API 응답에서는 제외
+ADMIN_ONLY_FIELDS = ("blob_name", "updated")
+
+# /api/images 에서 서버 측 필터로 지원하는 필드 (역색인 대상)
+INDEXED_FIELDS = ("group", "member", "category", "file_type", "version")
+
+def _catalog_sort_key(entry):
+    """정렬 키 - unique_id(숫자) 다음 filename 으로 동순위 구분"""
+    uid = str(entry.get("unique_id", "") or "")
+    return (int(uid) if uid.isdigit() else 0, entry.get("filename", ""))
+
+def encode_cursor(key):
+    raw = f"{key[0]}:{key[1]}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor):
+    """잘못된 커서는 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        uid, filename = raw.split(":", 1)
+        return (int(uid), filename)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+_snapshot_serials = itertools.count(1)
+
+class CatalogSnapshot:
+    """한 번의 버킷 목록 조회로 만든 불변 카탈로그"""
+
+    def __init__(self, entries):
+        # unique_id 기준 내림차순 정렬
+        entries.sort(key=_catalog_sort_key, reverse=True)
+        self.entries = entries
+        self.keys = [_catalog_sort_key(e) for e in entries]
+        self.public = [
+            {k: v for k, v in e.items() if k not in ADMIN_ONLY_FIELDS}
+            for e in entries
+        ]
+        # 역색인: field -> value -> 정렬 순서의 위치 목록 (오름차순)
+        self.index = {field: {} for field in INDEXED_FIELDS}
+        for pos, entry in enumerate(entries):
+            for field in INDEXED_FIELDS:
+                value = entry.get(field)
+                if value:
+                    self.index[field].setdefault(value, []).append(pos)
+        # 관리자 검색용 - 최근 수정 순 위치 목록
+        self.by_updated = sorted(range(len(entries)), key=lambda p: entries[p].get("updated", ""), reverse=True)
+        # 트레이드 매칭용 - unique_id 마다 비트 위치 하나
+        self.uid_positions = {}
+        for entry in entries:
+            uid = entry.get("unique_id")
+            if uid and uid not in self.uid_positions:
+                self.uid_positions[uid] = len(self.uid_positions)
+        self.position_uids = list(self.uid_positions)
+        self.all_mask = (1 << len(self.position_uids)) - 1
+        self.serial = next(_snapshot_serials)  # 스냅샷마다 고유 - 카탈로그 기준 캐시의 키
+        self.version = None  # 매니페스트로 만든 경우 그 버전
+
+    def _position_after(self, key):
+        """내림차순 keys 에서 key 보다 뒤(작은 값)인 첫 위치"""
+        lo, hi = 0, len(self.keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.keys[mid] >= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def page(self, filters, limit, cursor=None):
+        """필터/커서 기반 페이지 조회 - 비용은 페이지 크기에 비례
+
+        filters: {field: value}, cursor: 이전 페이지의 next_cursor
+        반환값: (items, next_cursor)
+        """
+        start = self._position_after(decode_cursor(cursor)) if cursor else 0
+
+        if filters:
+            postings = []
+            for field, value in filters.items():
+                posting = self.index[field].get(value)
+                if not posting:
+                    return [], None
+                postings.append((len(posting), field, posting))
+            # 가장 짧은 목록을 기준으로 순회하고 나머지 필터는 항목에서 직접 확인
+            postings.sort(key=lambda p: p[0])
+            _, driver, posting = postings[0]
+            # 꼬리를 복사하지 않고 시작 위치부터 인덱스로 순회 - 비용은 페이지 크기에 비례
+            candidates = map(posting.__getitem__, range(bisect_left(posting, start), len(posting)))
+            rest = [(f, v) for f, v in filters.items() if f != driver]
+        else:
+            candidates = range(start, len(self.entries))
+            rest = []
+
+        positions = []
+        for pos in candidates:
+            entry = self.entries[pos]
+            if all(entry.get(f) == v for f, v in rest):
+                positions.append(pos)
+                if len(positions) > limit:
+                    break
+
+        has_more = len(positions) > limit
+        positions = positions[:limit]
+        items = [self.public[pos] for pos in positions]
+        next_cursor = encode_cursor(self.keys[positions[-1]]) if has_more else None
+        return items, next_cursor
+
+class ImageCatalog:
+    """파싱된 이미지 목록을 메모리에 보관하고 TTL마다 백그라운드 갱신
+
+    매니페스트가 있으면 버전(blob 메타데이터)만 확인하고 바뀌었을 때만 내려받음.
+    없으면 버킷 목록 조회로 구성.
+    """
+
+    def __init__(self, ttl, manifest_poll=None, bundled=None):
+        self.ttl = ttl
+        self.manifest_poll = manifest_poll
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0  # 현재 스냅샷이 최신인지 마지막으로 확인한 시각 (스냅샷은 수정하지 않음)
+        self._generation = 0
+        self._flight = SingleFlight()
+        if bundled is not None:
+            # 함께 배포한 매니페스트로 바로 응답하고, 첫 조회 때 최신 버전인지 확인
+            snapshot = CatalogSnapshot(bundled["entries"])
+            snapshot.version = bundled["version"]
+            self._snapshot = snapshot
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            # 콜드 캐시 - 동시 요청은 하나의 목록 조회를 함께 기다림
+            return self._flight.do("catalog", self._build)
+        ttl = self.manifest_poll if snapshot.version is not None and self.manifest_poll else self.ttl
+        if time.monotonic() - self._checked_at > ttl:
+            # 만료된 스냅샷은 그대로 응답하고 갱신은 백그라운드에서
+            self._refresh_in_background()
+        return snapshot
+
+    def apply(self, upserts=(), removals=(), manifest=None):
+        """업로드/삭제를 현재 스냅샷에 바로 반영 - 목록 재조회 없음
+
+        갱신된 매니페스트를 받으면 그 내용(다른 곳의 변경 포함)으로 교체.
+        """
+        with self._lock:
+            # 진행 중인 빌드는 변경 전 내용이므로 저장되지 않도록 세대 증가
+            self._generation += 1
+            generation = self._generation
+            current = self._snapshot
+        if manifest is not None:
+            snapshot = CatalogSnapshot(list(manifest["entries"]))
+            snapshot.version = manifest["version"]
+        elif current is not None:
+            by_name = {e["blob_name"]: e for e in current.entries}
+            for name in removals:
+                by_name.pop(name, None)
+            for entry in upserts:
+                by_name[entry["blob_name"]] = entry
+            snapshot = CatalogSnapshot(list(by_name.values()))
+            snapshot.version = current.version
+        else:
+            return  # 아직 카탈로그가 없으면 다음 조회에서 구성
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """즉시 무효화 - 다음 조회 시 다시 목록을 가져옴"""
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+    def _refresh_in_background(self):
+        if self._flight.in_flight("catalog"):
+            return
+        threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+    def _refresh_quietly(self):
+        try:
+            self._flight.do("catalog", self._build)
+        except Exception as e:
+            print(f"카탈로그 갱신 오류: {e}")
+
+    def _build_from_manifest(self):
+        """매니페스트로 스냅샷 구성 - 매니페스트가 없거나 읽을 수 없으면 None"""
+        try:
+            blob = bucket.get_blob(MANIFEST_BLOB)
+            if blob is None:
+                return None
+            current = self._snapshot
+            version = manifest_version(blob)
+            if current is not None and version is not None and current.version == version:
+                # 변경 없음 - 다운로드/파싱 생략 (확인 시각은 _build 에서 갱신)
+                return current
+            manifest = decode_manifest(blob.download_as_bytes())
+        except Exception as e:
+            print(f"카탈로그 매니페스트 로드 오류: {e}")
+            return None
+        snapshot = CatalogSnapshot(manifest["entries"])
+        snapshot.version = manifest["version"]
+        return snapshot
+
+    def _build(self):
+        generation = self._generation
+        snapshot = self._build_from_manifest() if self.manifest_poll else None
+        if snapshot is None:
+            snapshot = CatalogSnapshot(list_catalog_entries(bucket, io_pool))
+
+        with self._lock:
+            # 빌드 도중 무효화되었다면 저장하지 않음 (삭제된 파일이 섞였을 수 있음)
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._checked_at = time.monotonic()
+        return snapshot
+
+def _load_bundled_manifest():
+    if not CATALOG_MANIFEST:
+        return None
+    try:
+        return load_manifest_file(CATALOG_MANIFEST_FILE)
+    except Exception as e:
+        print(f"번들 카탈로그 매니페스트 로드 오류: {e}")
+        return None
+
+image_catalog = ImageCatalog(
+    CATALOG_TTL,
+    CATALOG_MANIFEST_POLL if CATALOG_MANIFEST else None,
+    _load_bundled_manifest()
+)
+
 # ────────────────────────────────────────────
 # 이미지 조회 API (Firebase Storage 사용)
 # ────────────────────────────────────────────
 
 @app.route("/api/images")
 def get_images():
+    args = request.args
+    filters = {f: args[f].strip() for f in INDEXED_FIELDS if (args.get(f) or "").strip()}
+    paginated = "limit" in args or "cursor" in args or filters
+
     try:
-        blobs = bucket.list_blobs()
-        images = []
-        
-        for blob in blobs:
-            # 이미지 파일인지 확인
-            if not any(blob.name.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                continue
-                
-            try:
-                # images/ 폴더 제거하고 실제 경로 추출
-                _, full_path = blob.name.split('/', 1)
-                
-                # 실제 file_type과 filename 분리
-                if '/' in full_path:
-                    file_type, filename = full_path.split('/', 1)
-                else:
-                    file_type = "unknown"
-                    filename = full_path
-            except ValueError:
-                file_type = "unknown"
-                filename = blob.name
-                
-            # 파일명 파싱 결과를 meta에 담음
-            meta = parse_filename(filename) or {}
-            meta.update({
-                "file_type": file_type,  # 이제 "event"가 됨
-                "filename": full_path,   # "event/IVE_AN_ARENA_351631.jpg"
-                "url": blob.public_url
-            })
-            
-            images.append(meta)
-        
-        # unique_id 기준 내림차순 정렬
-        images.sort(key=lambda x: int(x.get("unique_id", 0) or 0), reverse=True)
-        
-        return jsonify(images)
+        snapshot = image_catalog.get()
+        if not paginated:
+            # 파라미터가 없으면 기존처럼 전체 배열 반환
+            return jsonify(snapshot.public)
+
+        limit = args.get("limit", 50, type=int)
+        if limit < 1:
+            limit = 1
+        if limit > 500:
+            limit = 500
+
+        try:
+            items, next_cursor = snapshot.page(filters, limit, args.get("cursor"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        return jsonify({"items": items, "next_cursor": next_cursor})
     except Exception as e:
         print(f"Firebase 이미지 조회 오류: {e}")
         return jsonify({"error": str(e)}), 500
@@ -401,41 +2244,97 @@ def get_images():
 
 @app.route('/')
 def index():
+    # 헬스 체크/업타임 핑이 들어오는 경로 - 버킷을 조회하지 않음
+    return render_template('index.html', images=[])
+
+@app.route('/catalog')
+def catalog_page():
+    """카탈로그를 포함한 페이지 렌더링 (명시적으로 요청할 때만)"""
     try:
-        blobs = bucket.list_blobs()
-        images = []
+        return render_template('index.html', images=image_catalog.get().public)
 
-        for blob in blobs:
-            if not any(blob.name.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                continue
+    except Exception as e:
+        print(f"Firebase 이미지 조회 오류: {e}")
+        return render_template('index.html', images=[])
 
-            try:
-                _, full_path = blob.name.split('/', 1)
+# ────────────────────────────────────────────
+# 헬스 체크 (liveness / readiness)
+# ────────────────────────────────────────────
 
-                if '/' in full_path:
-                    file_type, filename = full_path.split('/', 1)
-                else:
-                    file_type = "unknown"
-                    filename = full_path
-            except ValueError:
-                file_type = "unknown"
-                filename = blob.name
-
-            meta = parse_filename(filename) or {}
-            meta.update({
-                "file_type": file_type,
-                "filename": full_path,
-                "url": blob.public_url
-            })
+HEALTH_PROBE_INTERVAL = int(os.environ.get("HEALTH_PROBE_INTERVAL", 30))  # 초
 
-            images.append(meta)
+def _probe_firebase():
+    # 존재하지 않는 경로 조회 - 응답이 작고 연결 여부만 확인
+    firebase_db.reference("_health").get()
 
-        images.sort(key=lambda x: int(x.get("unique_id", 0) or 0), reverse=True)
-        return render_template('index.html', images=images)
+def _probe_firestore():
+    db.collection("_health").document("probe").get()
 
-    except Exception as e:
-        print(f"Firebase 이미지 조회 오류: {e}")
-        return render_template('index.html', images=[])
+def _probe_sqlite():
+    get_db().execute("SELECT 1").fetchone()
+
+class HealthProbe:
+    """외부 의존성 연결 상태를 백그라운드에서 확인하고 결과를 캐시"""
+
+    def __init__(self, probes, interval):
+        self.probes = probes
+        self.interval = interval
+        self._results = {}
+        self._checked_at = None
+        self._flight = SingleFlight()
+
+    def status(self):
+        """캐시된 결과 반환 - 오래되었으면 백그라운드에서 다시 확인"""
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at > self.interval:
+            if not self._flight.in_flight("probe"):
+                threading.Thread(target=self._run_quietly, daemon=True).start()
+        return dict(self._results), checked_at
+
+    def _run_quietly(self):
+        try:
+            self._flight.do("probe", self._run)
+        except Exception as e:
+            print(f"헬스 체크 오류: {e}")
+
+    def _run(self):
+        results = {}
+        for name, probe in self.probes.items():
+            started = time.monotonic()
+            try:
+                probe()
+                results[name] = {"ok": True}
+            except Exception as e:
+                results[name] = {"ok": False, "error": str(e)}
+            results[name]["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        self._results = results
+        self._checked_at = time.monotonic()
+
+health_probe = HealthProbe({
+    "firebase": _probe_firebase,
+    "firestore": _probe_firestore,
+    "sqlite": _probe_sqlite,
+}, HEALTH_PROBE_INTERVAL)
+
+@app.get("/healthz")
+def healthz():
+    """liveness - 프로세스가 응답하는지만 확인"""
+    return jsonify({"ok": True})
+
+@app.get("/readyz")
+def readyz():
+    """readiness - 캐시된 의존성 확인 결과로 응답 (요청 경로에서 외부 호출 없음)"""
+    checks, checked_at = health_probe.status()
+    ready = bool(checks) and all(c["ok"] for c in checks.values())
+    age = round(time.monotonic() - checked_at, 1) if checked_at is not None else None
+    return jsonify({
+        "ready": ready,
+        "checks": checks,
+        "checked_seconds_ago": age,
+        "sqlite_mirror": sqlite_mirror.stats(),
+        "rtdb_reads": rtdb_reader.stats(),
+        "local_replica": local_replica.stats()
+    }), (200 if ready else 503)
 
 
 # ────────────────────────────────────────────
@@ -481,6 +2380,214 @@ def djemals_ping():
 def zzztest():
     return "zzz ok"
 
+# ────────────────────────────────────────────
+# 방문 통계 집계 (요청마다 Firestore 를 읽고 쓰지 않음)
+# ────────────────────────────────────────────
+
+TRACK_FLUSH_INTERVAL = int(os.environ.get("TRACK_FLUSH_INTERVAL", 10))  # 초
+HLL_PRECISION = 12  # 레지스터 4096개 (4KB) - 표준 오차 약 1.6%
+
+class HyperLogLog:
+    """고유 방문자 수 추정용 스케치 - 레지스터별 max 로 병합 가능"""
+
+    def __init__(self, registers=None, p=HLL_PRECISION):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers else bytearray(self.m)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+        idx = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        regs = self.registers
+        for i, r in enumerate(other.registers):
+            if r > regs[i]:
+                regs[i] = r
+        return self
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 작은 값은 linear counting 이 더 정확
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+# 이벤트 이름은 Firestore 필드 경로로 쓰이므로 허용 문자만
+EVENT_NAME_MAX = 40
+
+def normalize_event_name(event):
+    event = str(event or "page_view").strip()
+    if not event or len(event) > EVENT_NAME_MAX or not all(ch.isalnum() or ch in "_-" for ch in event):
+        return "other"
+    return event
+
+def _new_track_bucket():
+    return {"views": 0, "events": {}, "sketch": HyperLogLog()}
+
+class TrackAggregator:
+    """이벤트를 메모리에 모았다가 주기적으로 Firestore 에 원자적으로 반영"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = {}  # date -> {"views": int, "events": {name: int}, "sketch": HyperLogLog}
+        self._thread = None
+
+    def record(self, date, uuid, event):
+        event = normalize_event_name(event)
+        with self._lock:
+            stats = self._pending.get(date)
+            if stats is None:
+                stats = self._pending[date] = _new_track_bucket()
+            if event == "page_view":
+                stats["views"] += 1
+            stats["events"][event] = stats["events"].get(event, 0) + 1
+            stats["sketch"].add(uuid)
+        self._ensure_started()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for date, stats in pending.items():
+            try:
+                _flush_daily_stats(db.transaction(), date, stats)
+            except Exception as e:
+                print(f"통계 반영 오류 ({date}): {e}")
+                # 다음 주기에 다시 시도하도록 되돌림
+                with self._lock:
+                    current = self._pending.setdefault(date, _new_track_bucket())
+                    current["views"] += stats["views"]
+                    for name, n in stats["events"].items():
+                        current["events"][name] = current["events"].get(name, 0) + n
+                    current["sketch"].merge(stats["sketch"])
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="track-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+# ────────────────────────────────────────────
+# 주간/월간 통계 롤업 (weekly_stats, monthly_stats)
+# ────────────────────────────────────────────
+
+def week_period(day):
+    """ISO 주 단위 - (문서 id, 시작일, 종료일)"""
+    start = day - timedelta(days=day.weekday())
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}", start, start + timedelta(days=6)
+
+def month_period(day):
+    start = day.replace(day=1)
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return start.strftime("%Y-%m"), start, next_month - timedelta(days=1)
+
+ROLLUPS = {
+    "week": ("weekly_stats", week_period),
+    "month": ("monthly_stats", month_period),
+}
+
+def _merge_stats_doc(transaction, doc_ref, snapshot, views, events, sketch):
+    """저장된 스케치와 병합하고 카운터는 Increment 로 반영 - 병합된 스케치 반환"""
+    stored = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    merged = HyperLogLog(stored.get("active_hll")).merge(sketch)
+    # 이전 방식(active_uuids 배열)으로 쌓인 방문자는 스케치로 옮기고 배열은 삭제
+    for legacy_uuid in stored.get("active_uuids") or []:
+        merged.add(legacy_uuid)
+
+    transaction.set(doc_ref, {
+        "views": firestore.Increment(views),
+        "events": {name: firestore.Increment(n) for name, n in events.items()},
+        "active_hll": merged.to_bytes(),
+        "active_uuids": firestore.DELETE_FIELD,
+        "active_count": merged.count(),
+        "updated_at": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+    return merged
+
+@firestore.transactional
+def _flush_daily_stats(transaction, date, stats):
+    """일간 문서와 해당 주/월 롤업 문서를 한 트랜잭션으로 갱신"""
+    day = datetime.strptime(date, "%Y-%m-%d").date()
+    daily_ref = db.collection("daily_stats").document(date)
+    rollup_refs = [
+        db.collection(collection).document(period(day)[0])
+        for collection, period in ROLLUPS.values()
+    ]
+
+    # 트랜잭션에서는 읽기를 모두 끝낸 뒤 쓰기
+    daily_snap = daily_ref.get(field_paths=["active_hll", "active_uuids"], transaction=transaction)
+    rollup_snaps = [ref.get(field_paths=["active_hll"], transaction=transaction) for ref in rollup_refs]
+
+    daily_sketch = _merge_stats_doc(
+        transaction, daily_ref, daily_snap, stats["views"], stats["events"], stats["sketch"]
+    )
+    # 롤업에는 일간 스케치 전체를 병합 (max 병합이라 중복 반영되어도 결과가 같음)
+    for ref, snap in zip(rollup_refs, rollup_snaps):
+        _merge_stats_doc(transaction, ref, snap, stats["views"], stats["events"], daily_sketch)
+
+def rebuild_rollups(dates):
+    """일간 문서로부터 주간/월간 롤업을 다시 계산해 덮어씀 (기존 데이터 백필용)
+
+    덮어쓰기이므로 dates 의 첫날보다 먼저 시작하는 기간(일부 날짜만 있는 기간)은 건너뜀.
+    """
+    col = db.collection("daily_stats")
+    first = min(datetime.strptime(d, "%Y-%m-%d").date() for d in dates)
+    totals = {}  # (collection, period_id) -> {"views", "events", "sketch"}
+    for doc in db.get_all([col.document(d) for d in dates]):
+        if not doc.exists:
+            continue
+        data = doc.to_dict() or {}
+        sketch = HyperLogLog(data.get("active_hll"))
+        for legacy_uuid in data.get("active_uuids") or []:
+            sketch.add(legacy_uuid)
+
+        day = datetime.strptime(doc.id, "%Y-%m-%d").date()
+        for collection, period in ROLLUPS.values():
+            period_id, start, _ = period(day)
+            if start < first:
+                continue
+            total = totals.setdefault((collection, period_id), _new_track_bucket())
+            total["views"] += data.get("views", 0)
+            for name, n in (data.get("events") or {}).items():
+                total["events"][name] = total["events"].get(name, 0) + n
+            total["sketch"].merge(sketch)
+
+    batch = db.batch()
+    for (collection, period_id), total in totals.items():
+        batch.set(db.collection(collection).document(period_id), {
+            "views": total["views"],
+            "events": total["events"],
+            "active_hll": total["sketch"].to_bytes(),
+            "active_count": total["sketch"].count(),
+            "updated_at": firestore.SERVER_TIMESTAMP
+        })
+    batch.commit()
+    return len(totals)
+
+track_aggregator = TrackAggregator(TRACK_FLUSH_INTERVAL)
+# 종료 시 남은 버퍼 반영 - SIGTERM 도 _exit_on_sigterm 이 SystemExit 로 바꿔 여기까지 옴
+atexit.register(track_aggregator.flush)
+
 @app.route("/api/track", methods=["GET", "POST"])
 def track_event():
     if request.method == "GET":
@@ -493,34 +2600,75 @@ def track_event():
 
     if not uuid:
         return jsonify({"error": "uuid required"}), 400
+    uuid = str(uuid)  # 숫자 uuid 도 기존처럼 허용 (HyperLogLog 는 문자열을 해시)
 
-    today = get_kst_date()
-    doc_ref = db.collection("daily_stats").document(today)
-    doc = doc_ref.get()
-
-    if doc.exists:
-        stats = doc.to_dict()
-        views = stats.get("views", 0)
-        active = stats.get("active_uuids", [])
-
-        if event == "page_view":
-            views += 1
-
-        if uuid not in active:
-            active.append(uuid)
-    else:
-        views = 1 if event == "page_view" else 0
-        active = [uuid]
-
-    doc_ref.set({
-        "views": views,
-        "active_uuids": active,
-        "active_count": len(active),
-        "updated_at": firestore.SERVER_TIMESTAMP
-    })
+    # 메모리에만 기록 - Firestore 반영은 track_aggregator 가 주기적으로 처리
+    track_aggregator.record(get_kst_date(), uuid, event)
 
     return jsonify({"ok": True})
 
+# 자정 이후 이 시간이 지나면 전날 통계는 더 이상 바뀌지 않는 것으로 간주 (버퍼 반영 대기)
+STATS_CLOSE_GRACE = max(300, TRACK_FLUSH_INTERVAL * 3)
+STATS_FIELDS = ["views", "active_count", "events"]
+
+class StatsReader:
+    """통계 문서를 한 번의 get_all 로 읽고, 끝난 기간은 메모리에 고정 캐시"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._closed = {}  # doc id -> row (변하지 않는 기간만)
+
+    def rows(self, periods, now):
+        """periods: [(doc id, 기간 마지막 날짜 "YYYY-MM-DD")]"""
+        closed_before = (now - timedelta(seconds=STATS_CLOSE_GRACE)).strftime("%Y-%m-%d")
+
+        with self._lock:
+            cached = {pid: self._closed[pid] for pid, _ in periods if pid in self._closed}
+        missing = [pid for pid, _ in periods if pid not in cached]
+
+        if missing:
+            col = db.collection(self.collection)
+            fetched = {pid: {"views": 0, "active_count": 0, "events": {}} for pid in missing}
+            # 필요한 필드만 가져옴 (스케치/레거시 배열 제외)
+            for doc in db.get_all([col.document(pid) for pid in missing], field_paths=STATS_FIELDS):
+                if doc.exists:
+                    data = doc.to_dict() or {}
+                    fetched[doc.id] = {
+                        "views": data.get("views", 0),
+                        "active_count": data.get("active_count", 0),
+                        "events": data.get("events") or {},
+                    }
+            with self._lock:
+                for pid, last_date in periods:
+                    if pid in fetched and last_date < closed_before:
+                        self._closed[pid] = fetched[pid]
+            cached.update(fetched)
+
+        return [cached[pid] for pid, _ in periods]
+
+stats_readers = {
+    "day": StatsReader("daily_stats"),
+    "week": StatsReader(ROLLUPS["week"][0]),
+    "month": StatsReader(ROLLUPS["month"][0]),
+}
+
+def _stats_periods(granularity, start, end):
+    """start~end 를 덮는 기간 목록 - [(doc id, 시작일, 종료일)]"""
+    if granularity == "day":
+        return [
+            (d.strftime("%Y-%m-%d"), d, d)
+            for d in (start + timedelta(days=i) for i in range((end - start).days + 1))
+        ]
+    period = ROLLUPS[granularity][1]
+    periods = []
+    day = start
+    while day <= end:
+        pid, p_start, p_end = period(day)
+        periods.append((pid, p_start, p_end))
+        day = p_end + timedelta(days=1)
+    return periods
+
 @app.get("/djemals/api/stats")
 @djemals_required
 def djemals_stats():
@@ -529,37 +2677,70 @@ def djemals_stats():
         days = 1
     if days > 365:
         days = 365
+    granularity = request.args.get("granularity", "day")
+    if granularity not in stats_readers:
+        return jsonify({"error": "granularity must be day, week or month"}), 400
 
     kst = timezone(timedelta(hours=9))
-    today = datetime.now(kst).date()
+    now = datetime.now(kst)
+    today = now.date()
+
+    periods = _stats_periods(granularity, today - timedelta(days=days - 1), today)
+    stats = stats_readers[granularity].rows(
+        [(pid, p_end.strftime("%Y-%m-%d")) for pid, _, p_end in periods], now
+    )
 
     rows = []
-    for i in range(days - 1, -1, -1):
-        d = today - timedelta(days=i)
-        doc_id = d.strftime("%Y-%m-%d")
-        doc = db.collection("daily_stats").document(doc_id).get()
-
-        if doc.exists:
-            data = doc.to_dict() or {}
-            rows.append({
-                "date": doc_id,
-                "views": data.get("views", 0),
-                "active_count": data.get("active_count", 0),
-            })
+    for (pid, p_start, p_end), row in zip(periods, stats):
+        row = dict(row)
+        if granularity == "day":
+            row["date"] = pid
         else:
-            rows.append({
-                "date": doc_id,
-                "views": 0,
-                "active_count": 0,
+            row.update({
+                "period": pid,
+                "start": p_start.strftime("%Y-%m-%d"),
+                "end": p_end.strftime("%Y-%m-%d")
             })
+        rows.append(row)
 
-    today_row = rows[-1] if rows else {"views": 0, "active_count": 0}
+    # 오늘 수치는 항상 일간 문서 기준
+    if granularity == "day":
+        today_row = rows[-1]
+    else:
+        today_id = today.strftime("%Y-%m-%d")
+        today_row = stats_readers["day"].rows([(today_id, today_id)], now)[0]
 
     return jsonify({
+        "granularity": granularity,
         "today_views": today_row["views"],
         "today_active": today_row["active_count"],
         "rows": rows
     })
+
+@app.post("/djemals/api/stats/rollup")
+@djemals_required
+def djemals_rebuild_rollups():
+    """기존 일간 통계로 주간/월간 롤업 재계산"""
+    days = request.args.get("days", 365, type=int)
+    days = min(max(days, 1), 730)
+
+    kst = timezone(timedelta(hours=9))
+    today = datetime.now(kst).date()
+    # 첫 주/월이 잘리지 않도록 해당 기간의 시작일부터 계산
+    # (둘 중 늦게 시작하는 쪽 앞의 기간은 일부만 포함되므로 rebuild_rollups 가 건너뜀)
+    first = today - timedelta(days=days - 1)
+    first = min(week_period(first)[1], month_period(first)[1])
+    dates = [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((today - first).days + 1)]
+
+    try:
+        rebuilt = rebuild_rollups(dates)
+        for granularity in ROLLUPS:
+            stats_readers[granularity] = StatsReader(ROLLUPS[granularity][0])
+        return jsonify({"ok": True, "rebuilt": rebuilt})
+    except Exception as e:
+        print(f"통계 롤업 재계산 오류: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.get("/djemals/api/images")
 @djemals_required
 def djemals_list_images():
@@ -572,54 +2753,89 @@ def djemals_list_images():
     if limit > 200:
         limit = 200
 
-    items = []
-
     try:
-        blobs = bucket.list_blobs(prefix="images/")
-
-        for blob in blobs:
-            name_lower = blob.name.lower()
-
-            if not any(name_lower.endswith(ext) for ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]):
-                continue
-
-            if file_type and not name_lower.startswith(f"images/{file_type}/"):
-                continue
-
-            if query and query not in name_lower:
-                continue
+        if request.args.get("source") == "bucket":
+            # 캐시를 거치지 않고 버킷에서 바로 조회 (업로드 직후 확인용)
+            items = search_bucket_images(bucket, query, file_type, limit)
+        else:
+            items = search_catalog_images(image_catalog.get(), query, file_type, limit)
+        return jsonify({"items": items})
 
-            try:
-                _, full_path = blob.name.split("/", 1)   # images/event/xxx.jpg -> event/xxx.jpg
-            except ValueError:
-                full_path = blob.name
+    except Exception as e:
+        print(f"djemals image search error: {e}")
+        return jsonify({"error": str(e)}), 500
 
-            if "/" in full_path:
-                real_file_type, filename = full_path.split("/", 1)
-            else:
-                real_file_type, filename = "unknown", full_path
-
-            meta = parse_filename(filename) or {}
-            meta.update({
-                "file_type": real_file_type,
-                "filename": full_path,
-                "url": blob.public_url,
-                "blob_name": blob.name,
-                "updated": blob.updated.isoformat() if blob.updated else ""
-            })
+def search_catalog_images(snapshot, query, file_type, limit):
+    """카탈로그에서 최근 수정 순으로 순회 - limit 개를 채우면 바로 중단"""
+    items = []
+    for pos in snapshot.by_updated:
+        item = snapshot.entries[pos]
+        if not admin_search_match(item["blob_name"].lower(), query, file_type):
+            continue
+        items.append(item)
+        if len(items) >= limit:
+            break
+    return items
+
+
+def delete_thumbnails(blob_name):
+    """원본 삭제 시 파생 이미지도 정리 - 완료 표시(가장 작은 webp)부터, 없는 파일은 무시"""
+    full_path = blob_name.split("/", 1)[1] if "/" in blob_name else blob_name
+    for name in [thumb_blob_name(full_path, w, ext) for w in THUMB_WIDTHS for ext in THUMB_FORMATS]:
+        try:
+            bucket.blob(name).delete()
+        except Exception as e:
+            if getattr(e, "code", None) != 404:
+                print(f"썸네일 삭제 오류 ({name}): {e}")
 
-            items.append(meta)
-            items.sort(key=lambda x: x.get("updated", ""), reverse=True)
-            items = items[:limit]
+def remove_from_manifest(blob_names):
+    """삭제한 원본을 매니페스트에서도 제거 - 실패해도 삭제 자체는 성공으로 처리
 
+    반환값: 갱신된 매니페스트 (없거나 실패하면 None)
+    """
+    if not CATALOG_MANIFEST:
+        return None
+    try:
+        return update_manifest(bucket, removals=blob_names)
+    except Exception as e:
+        print(f"카탈로그 매니페스트 갱신 오류: {e}")
+        return None
 
-        return jsonify({"items": items})
+def admin_blob_name(filename):
+    return filename if filename.startswith("images/") else f"images/{filename}"
 
+def delete_image(blob_name):
+    """원본과 파생 이미지 삭제 - exists() 확인 없이 바로 삭제하고 없으면 False"""
+    try:
+        bucket.blob(blob_name).delete()
     except Exception as e:
-        print(f"djemals image search error: {e}")
+        if getattr(e, "code", None) == 404:
+            return False
+        raise
+    delete_thumbnails(blob_name)
+    return True
+
+def finish_image_removals(blob_names):
+    """삭제 후 매니페스트와 카탈로그 캐시를 한 번에 갱신"""
+    if not blob_names:
+        return
+    manifest = remove_from_manifest(blob_names)
+    image_catalog.apply(removals=blob_names, manifest=manifest)
+
+@app.post("/djemals/api/catalog/rebuild")
+@djemals_required
+def djemals_rebuild_catalog():
+    """버킷 목록으로 매니페스트를 새로 만듦 (콘솔에서 직접 파일을 바꾼 경우 등)"""
+    try:
+        manifest = update_manifest(
+            bucket, seed=lambda: list_catalog_entries(bucket, io_pool), rebuild=True
+        )
+        image_catalog.invalidate()
+        return jsonify({"ok": True, "version": manifest["version"], "count": len(manifest["entries"])})
+    except Exception as e:
+        print(f"djemals catalog rebuild error: {e}")
         return jsonify({"error": str(e)}), 500
 
-
 @app.delete("/djemals/api/images")
 @djemals_required
 def djemals_delete_image():
@@ -629,51 +2845,277 @@ def djemals_delete_image():
     if not filename:
         return jsonify({"error": "filename required"}), 400
 
-    blob_name = filename if filename.startswith("images/") else f"images/{filename}"
+    blob_name = admin_blob_name(filename)
 
     try:
-        blob = bucket.blob(blob_name)
-        if not blob.exists():
+        if not delete_image(blob_name):
             return jsonify({"error": "file not found"}), 404
 
-        blob.delete()
+        finish_image_removals([blob_name])
         return jsonify({"ok": True, "deleted": blob_name})
 
     except Exception as e:
         print(f"djemals image delete error: {e}")
         return jsonify({"error": str(e)}), 500
 
+BULK_DELETE_MAX = int(os.environ.get("BULK_DELETE_MAX", 1000))        # 요청 하나에서 지울 수 있는 최대 개수
+BULK_DELETE_WORKERS = int(os.environ.get("BULK_DELETE_WORKERS", 16))  # 동시 삭제 요청 수
+
+def _bulk_delete_targets(data):
+    """filenames 목록 또는 file_type/query 필터로 삭제 대상 blob 이름 목록 (중복 제거, 순서 유지)"""
+    filenames = data.get("filenames")
+    if filenames is not None:
+        if not isinstance(filenames, list) or not all(isinstance(f, str) for f in filenames):
+            raise ValueError("filenames must be a list of strings")
+        names = [admin_blob_name(f.strip()) for f in filenames if f.strip()]
+    else:
+        query = (data.get("query") or "").strip().lower()
+        file_type = (data.get("file_type") or "").strip().lower()
+        if not query and not file_type:
+            # 실수로 전체를 지우지 않도록 필터 하나는 반드시 필요
+            raise ValueError("filenames, file_type or query required")
+        if data.get("source") == "bucket":
+            items = search_bucket_images(bucket, query, file_type, BULK_DELETE_MAX + 1)
+        else:
+            items = search_catalog_images(image_catalog.get(), query, file_type, BULK_DELETE_MAX + 1)
+        names = [item["blob_name"] for item in items]
+
+    names = list(dict.fromkeys(names))
+    if not names:
+        raise ValueError("no matching files")
+    if len(names) > BULK_DELETE_MAX:
+        raise ValueError(f"too many files (max {BULK_DELETE_MAX}) - narrow the filter")
+    return names
+
+@app.post("/djemals/api/images/bulk-delete")
+@djemals_required
+def djemals_bulk_delete_images():
+    """여러 이미지를 동시에 삭제하고 항목별 결과 반환
+
+    body: {"filenames": [...]} 또는 {"file_type": "...", "query": "...", "source": "bucket"}
+    dry_run=true 면 삭제하지 않고 대상 목록만 반환.
+    매니페스트/카탈로그 갱신은 마지막에 한 번만.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        names = _bulk_delete_targets(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"djemals bulk delete search error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    if data.get("dry_run"):
+        return jsonify({"ok": True, "dry_run": True, "count": len(names), "targets": names})
+
+    results = []
+    deleted = []
+    # 요청 경로 조회에 쓰는 io_pool 을 막지 않도록 별도의 제한된 풀 사용
+    with ThreadPoolExecutor(max_workers=min(BULK_DELETE_WORKERS, len(names)), thread_name_prefix="delete") as pool:
+        for blob_name, future in [(n, pool.submit(delete_image, n)) for n in names]:
+            try:
+                if future.result():
+                    deleted.append(blob_name)
+                    results.append({"blob_name": blob_name, "ok": True, "status": 200})
+                else:
+                    results.append({"blob_name": blob_name, "ok": False, "status": 404, "error": "file not found"})
+            except Exception as e:
+                print(f"djemals bulk delete error ({blob_name}): {e}")
+                results.append({"blob_name": blob_name, "ok": False, "status": 500, "error": str(e)})
+
+    finish_image_removals(deleted)
+    return jsonify({
+        "ok": len(deleted) == len(names),
+        "requested": len(names),
+        "deleted": len(deleted),
+        "results": results
+    })
+
 # ────────────────────────────────────────────
-# Helper – 파일명 파싱
+# 관리자 이미지 업로드 (templates/admin_upload.html)
 # ────────────────────────────────────────────
 
-def parse_filename(filename: str):
-    base = os.path.splitext(filename)[0]
-    tokens = base.split('_')
-    if len(tokens) < 4:
-        return None
-    mapping = {
-        'AN': '유진', 'WON': '원영', 'GA': '가을', 'REI': '레이',
-        'LIZ': '리즈', 'LEE': '이서', 'II': "I've IVE", 'LD': 'LOVE DIVE'
-    }
-    unique_id = tokens[-1]
-    mapped = []
-    for t in tokens[:-1]:
-        for k, v in mapping.items():
-            t = t.replace(k, v)
-        mapped.append(t)
-    group, member, category, *middle = mapped
-    title = middle[0] if middle else ''
-    version = middle[1] if len(middle) > 1 else ''
-    return {
-        'group': group, 'member': member, 'category': category,
-        'title': title, 'version': version, 'unique_id': unique_id
-    }
+# 업로드 한 번의 요청 본문 최대 크기 / 파일 수
+ADMIN_UPLOAD_MAX_BYTES = int(os.environ.get("ADMIN_UPLOAD_MAX_BYTES", 200 * 1024 * 1024))
+ADMIN_UPLOAD_MAX_FILES = int(os.environ.get("ADMIN_UPLOAD_MAX_FILES", 50))
+# Content-Length 가 없는 chunked 요청도 읽는 도중에 끊도록 werkzeug 에 본문 크기 제한을 맡김
+app.config["MAX_CONTENT_LENGTH"] = ADMIN_UPLOAD_MAX_BYTES
+# GCS 로 보내는 조각 크기 (256KB 의 배수) - 메모리에는 이 크기만큼만 올라감
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024)) // (256 * 1024) * (256 * 1024) or 256 * 1024
+ADMIN_UPLOAD_FILE_TYPES = tuple(
+    t.strip() for t in os.environ.get("ADMIN_UPLOAD_FILE_TYPES", "album,특전,md,event").split(",") if t.strip()
+)
+
+# 확장자별 파일 시그니처 - 확장자만 바꾼 다른 형식의 파일을 거름
+IMAGE_SIGNATURES = {
+    ".jpg": (b"\xff\xd8\xff",), ".jpeg": (b"\xff\xd8\xff",),
+    ".png": (b"\x89PNG\r\n\x1a\n",),
+    ".gif": (b"GIF87a", b"GIF89a"),
+    ".webp": (b"RIFF",),
+}
+IMAGE_CONTENT_TYPES = {
+    ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+    ".gif": "image/gif", ".webp": "image/webp"
+}
+
+class UploadRejected(Exception):
+    """업로드 항목 검증 실패 (status: 응답 코드)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def _has_image_signature(stream, ext):
+    head = stream.read(12)
+    stream.seek(0)
+    if ext == ".webp" and head[8:12] != b"WEBP":
+        return False
+    return head.startswith(IMAGE_SIGNATURES[ext])
+
+def validate_upload_name(original_name, file_type, custom_filename=""):
+    """업로드 대상 blob 이름 (images/<file_type>/<파일명>) - 규칙에 맞지 않으면 UploadRejected
+
+    파일명은 GROUP_MEMBER_CATEGORY_..._UNIQUEID (UNIQUEID 는 숫자) 형식이어야 함.
+    """
+    if file_type not in ADMIN_UPLOAD_FILE_TYPES:
+        raise UploadRejected(f"unknown file_type: {file_type}")
+
+    ext = os.path.splitext(original_name or "")[1].lower()
+    if ext not in IMAGE_EXTENSIONS:
+        raise UploadRejected(f"unsupported extension: {original_name}")
+
+    stem = (custom_filename or os.path.splitext(os.path.basename(original_name))[0]).strip()
+    if not stem or any(c in stem for c in '/\\') or stem.startswith("."):
+        raise UploadRejected(f"invalid filename: {stem}")
+
+    filename = f"{stem}{ext}"
+    parsed = parse_filename(filename)
+    if parsed is None or not parsed["unique_id"].isdigit():
+        raise UploadRejected(f"filename must be GROUP_MEMBER_CATEGORY_..._UNIQUEID: {filename}")
+    return f"images/{file_type}/{filename}"
+
+def upload_derivative_images(source, full_path):
+    """파생 이미지 생성/업로드 - 완료 표시 파일(가장 작은 webp)이 마지막"""
+    for name, data, content_type in render_derivatives(source, full_path):
+        blob = bucket.blob(name)
+        blob.cache_control = THUMB_CACHE_CONTROL
+        blob.upload_from_string(data, content_type=content_type, predefined_acl="publicRead")
+
+def store_upload(upload, blob_name, overwrite=False):
+    """업로드 파일 하나를 조각 단위로 GCS 에 전송하고 카탈로그 항목 반환"""
+    ext = os.path.splitext(blob_name)[1].lower()
+    stream = upload.stream
+    if not _has_image_signature(stream, ext):
+        raise UploadRejected(f"not a {ext} image")
+
+    # chunk_size 를 지정하면 resumable 업로드 - 파일 전체를 메모리에 올리지 않음
+    blob = bucket.blob(blob_name, chunk_size=UPLOAD_CHUNK_SIZE)
+    try:
+        blob.upload_from_file(
+            stream,
+            content_type=IMAGE_CONTENT_TYPES[ext],
+            predefined_acl="publicRead",
+            # 같은 이름의 파일이 이미 있으면 덮어쓰지 않음 (overwrite=1 이면 교체)
+            if_generation_match=None if overwrite else 0
+        )
+    except Exception as e:
+        if getattr(e, "code", None) == 412:
+            raise UploadRejected(f"already exists: {blob_name}", 409)
+        raise
+
+    full_path = blob_name.split("/", 1)[1]
+    thumbnails = set()
+    try:
+        stream.seek(0)
+        upload_derivative_images(stream, full_path)
+        thumbnails.add(os.path.splitext(full_path)[0])
+    except ImportError:
+        pass  # Pillow 가 없으면 원본만 (static/make_thumbnails.py 로 백필)
+    except Exception as e:
+        print(f"썸네일 생성 오류 ({blob_name}): {e}")
+    return build_image_entry(blob, thumbnails)
+
+@app.get("/admin/upload")
+@djemals_required
+def admin_upload_page():
+    return render_template("admin_upload.html")
+
+@app.post("/admin/upload")
+@djemals_required
+def admin_upload():
+    """이미지 여러 개 업로드 - 파일별 결과를 반환하고 카탈로그/매니페스트는 한 번에 갱신
+
+    multipart 본문은 werkzeug 가 큰 파일을 임시 파일로 받아 두므로
+    요청 처리 중 메모리에는 GCS 조각 하나 크기만 올라감.
+    """
+    wants_json = request.accept_mimetypes.best_match(["application/json", "text/html"]) == "application/json"
+
+    def respond(payload, status):
+        if wants_json:
+            return jsonify(payload), status
+        for item in payload.get("results", []):
+            flash(f"{item['filename']}: {'업로드 완료' if item['ok'] else item['error']}")
+        if "error" in payload:
+            flash(payload["error"])
+        return redirect(url_for("admin_upload_page"))
+
+    try:
+        files = [f for f in request.files.getlist("file") if f and f.filename]
+    except RequestEntityTooLarge:
+        return respond({"error": "request too large"}, 413)
+    if not files:
+        return respond({"error": "file required"}, 400)
+    if len(files) > ADMIN_UPLOAD_MAX_FILES:
+        return respond({"error": f"too many files (max {ADMIN_UPLOAD_MAX_FILES})"}, 400)
+
+    file_type = (request.form.get("file_type") or "").strip()
+    custom_filename = (request.form.get("custom_filename") or "").strip()
+    overwrite = request.form.get("overwrite") == "1"
+    if custom_filename and len(files) > 1:
+        return respond({"error": "custom_filename only applies to a single file"}, 400)
+
+    results = []
+    entries = []
+    seen = set()
+    for upload in files:
+        item = {"filename": upload.filename, "ok": False}
+        try:
+            blob_name = validate_upload_name(upload.filename, file_type, custom_filename)
+            if blob_name in seen:
+                raise UploadRejected(f"duplicate in batch: {blob_name}")
+            seen.add(blob_name)
+            entry = store_upload(upload, blob_name, overwrite)
+            entries.append(entry)
+            item.update(ok=True, blob_name=blob_name, url=entry["url"], status=201)
+        except UploadRejected as e:
+            item.update(error=str(e), status=e.status)
+        except Exception as e:
+            print(f"admin upload error ({upload.filename}): {e}")
+            item.update(error=str(e), status=500)
+        results.append(item)
+
+    if entries:
+        manifest = None
+        if CATALOG_MANIFEST:
+            try:
+                manifest = update_manifest(bucket, upserts=entries)
+            except Exception as e:
+                print(f"카탈로그 매니페스트 갱신 오류: {e}")
+        image_catalog.apply(upserts=entries, manifest=manifest)
+
+    status = 200 if entries else max(item["status"] for item in results)
+    return respond({"ok": len(entries) == len(results), "uploaded": len(entries), "results": results}, status)
 
 # ────────────────────────────────────────────
 # Entrypoint
 # ────────────────────────────────────────────
 
+def _exit_on_sigterm(signum, frame):
+    # SIGTERM 에는 atexit 가 실행되지 않으므로 SystemExit 로 바꿔 미러/통계 버퍼를 비우고 종료
+    sys.exit(0)
+
 if __name__ == '__main__':
+    # 개발 서버(render.yaml 의 python app.py)만 - gunicorn 은 워커 신호 처리를 직접 함
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""관리자 이미지 검색(?source=bucket) 벤치마크 - 메모리 가짜 버킷으로 이전 구현과 비교
+
+    python bench/bench_admin_search.py [blob 수]
+
+경우마다 결과가 이전 구현과 같은지도 확인 (다르면 종료 코드 1).
+"""
+import os
+import sys
+import time
+import random
+from datetime import datetime, timezone, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from catalog_manifest import parse_filename, search_bucket_images
+from legacy import legacy_admin_search
+
+FILE_TYPES = ["event", "md", "benefit", "album", "season"]
+MEMBERS = ["AN", "WON", "GA", "REI", "LIZ", "LEE"]
+CASES = [
+    # (설명, query, file_type, limit)
+    ("no filter, limit 50", "", "", 50),
+    ("file_type=md, limit 200", "", "md", 200),
+    ("query+event, limit 50", "popup", "event", 50),
+]
+
+
+class FakeBlob:
+    def __init__(self, bucket, name, updated):
+        self.bucket = bucket
+        self.name = name
+        self.updated = updated
+        self.public_url = f"https://storage.googleapis.com/fake/{name}"
+
+
+class FakeBucket:
+    """list_blobs(prefix=...) 만 흉내 - GCS 처럼 이름 순으로 반환"""
+
+    def __init__(self, count, seed=0):
+        rng = random.Random(seed)
+        base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        # 수정 시각은 모두 다르게 (동률 정렬 차이로 비교가 흔들리지 않도록)
+        offsets = rng.sample(range(count * 10), count)
+        blobs = []
+        for i, offset in enumerate(offsets):
+            file_type = FILE_TYPES[i % len(FILE_TYPES)]
+            event = "MINIVEpopup2" if i % 7 == 0 else f"EVENT{i % 53}"
+            ext = ".webp" if i % 11 == 0 else ".jpg"
+            name = f"images/{file_type}/IVE_{MEMBERS[i % 6]}_{event}_MS_{351000 + i}{ext}"
+            blobs.append(FakeBlob(self, name, base + timedelta(seconds=offset)))
+        self._blobs = sorted(blobs, key=lambda b: b.name)
+
+    def list_blobs(self, prefix=""):
+        return iter([b for b in self._blobs if b.name.startswith(prefix)])
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    bucket = FakeBucket(count)
+    print(f"가짜 버킷 blob {count}개")
+    failed = False
+    for label, query, file_type, limit in CASES:
+        old, old_ms = timed(lambda: legacy_admin_search(bucket, query, file_type, limit, parse=parse_filename))
+        new, new_ms = timed(lambda: search_bucket_images(bucket, query, file_type, limit))
+        same = old == new
+        failed |= not same
+        print(f"  {label:<26} 이전 {old_ms:7.1f}ms, 힙 {new_ms:7.1f}ms, 결과 {'동일' if same else '다름'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""parse_filename 마이크로 벤치마크 - 이전 구현 대비 (메모이즈 적중 / 처음 보는 파일명)
+
+    python bench/bench_parse_filename.py [반복 횟수] [고유 파일명 수]
+"""
+import os
+import sys
+import json
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from catalog_manifest import parse_filename, _parse_filename_cached
+from legacy import legacy_parse_filename
+
+
+def timed(fn, names, rounds=1):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for name in names:
+            fn(name)
+    return time.perf_counter() - start
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    unique = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    with open(os.path.join(ROOT, "static", "firebase_url_mapping.json"), encoding="utf-8") as f:
+        names = [os.path.basename(path) for path in json.load(f)]
+    print(f"매핑 파일명 {len(names)}개 x {rounds}회 (메모이즈 적중)")
+    print(f"  이전 {timed(legacy_parse_filename, names, rounds):.2f}s, 현재 {timed(parse_filename, names, rounds):.2f}s")
+
+    # 카탈로그 첫 구성처럼 모두 처음 보는 파일명
+    members = ["AN", "WON", "GA", "REI", "LIZ", "LEE"]
+    cold = [f"IVE_{members[i % 6]}_EVENT{i % 97}_MS_v{i % 5}_{351000 + i}.jpg" for i in range(unique)]
+    _parse_filename_cached.cache_clear()
+    print(f"고유 파일명 {unique}개 (캐시 미적중)")
+    print(f"  이전 {timed(legacy_parse_filename, cold):.2f}s, 현재 {timed(parse_filename, cold):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
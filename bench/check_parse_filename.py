@@ -0,0 +1,26 @@
+"""골든 테스트 - static/firebase_url_mapping.json 의 모든 파일명에서 이전 구현과 결과가 같은지
+
+    python bench/check_parse_filename.py
+"""
+import os
+import sys
+import json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from catalog_manifest import parse_filename
+from legacy import legacy_parse_filename
+
+
+def main():
+    with open(os.path.join(ROOT, "static", "firebase_url_mapping.json"), encoding="utf-8") as f:
+        names = [os.path.basename(path) for path in json.load(f)]
+    mismatches = [n for n in names if parse_filename(n) != legacy_parse_filename(n)]
+    for name in mismatches:
+        print(f"불일치: {name}\n  이전: {legacy_parse_filename(name)}\n  현재: {parse_filename(name)}")
+    print(f"{len(names) - len(mismatches)}/{len(names)} 일치")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""비교 기준용 이전 구현 - 골든 테스트/벤치마크에서만 사용"""
+import os
+
+
+def legacy_parse_filename(filename: str):
+    """토큰마다 매핑 전체를 str.replace 하던 이전 parse_filename"""
+    base = os.path.splitext(filename)[0]
+    tokens = base.split('_')
+    if len(tokens) < 4:
+        return None
+    mapping = {
+        'AN': '유진', 'WON': '원영', 'GA': '가을', 'REI': '레이',
+        'LIZ': '리즈', 'LEE': '이서', 'II': "I've IVE", 'LD': 'LOVE DIVE'
+    }
+    unique_id = tokens[-1]
+    mapped = []
+    for t in tokens[:-1]:
+        for k, v in mapping.items():
+            t = t.replace(k, v)
+        mapped.append(t)
+    group, member, category, *middle = mapped
+    title = middle[0] if middle else ''
+    version = middle[1] if len(middle) > 1 else ''
+    return {
+        'group': group, 'member': member, 'category': category,
+        'title': title, 'version': version, 'unique_id': unique_id
+    }
+
+
+def legacy_admin_search(bucket, query, file_type, limit, parse=legacy_parse_filename):
+    """매 항목마다 결과 목록을 다시 정렬하던 이전 djemals_list_images 검색"""
+    items = []
+    for blob in bucket.list_blobs(prefix="images/"):
+        name_lower = blob.name.lower()
+        if not any(name_lower.endswith(ext) for ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]):
+            continue
+        if file_type and not name_lower.startswith(f"images/{file_type}/"):
+            continue
+        if query and query not in name_lower:
+            continue
+
+        try:
+            _, full_path = blob.name.split("/", 1)
+        except ValueError:
+            full_path = blob.name
+        if "/" in full_path:
+            real_file_type, filename = full_path.split("/", 1)
+        else:
+            real_file_type, filename = "unknown", full_path
+
+        meta = parse(filename) or {}
+        meta.update({
+            "file_type": real_file_type,
+            "filename": full_path,
+            "url": blob.public_url,
+            "blob_name": blob.name,
+            "updated": blob.updated.isoformat() if blob.updated else ""
+        })
+        items.append(meta)
+        items.sort(key=lambda x: x.get("updated", ""), reverse=True)
+        items = items[:limit]
+    return items
@@ -0,0 +1,289 @@
+"""이미지 카탈로그 항목/매니페스트 - app.py 와 static/ 업로드 스크립트가 함께 사용
+
+Firebase 초기화 없이 import 할 수 있어야 하므로 bucket 은 인자로 받음.
+"""
+import os
+import io
+import sys
+import gzip
+import json
+import time
+import heapq
+from datetime import datetime, timezone
+from functools import lru_cache
+
+IMAGE_PREFIX = "images"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+# ────────────────────────────────────────────
+# 파일명 파싱
+# ────────────────────────────────────────────
+
+# 토큰 단위 정확 매핑 (부분 문자열 치환 X - 'LEE', 'II' 등이 다른 토큰에 섞여 들어가지 않도록)
+FILENAME_TOKEN_MAP = {
+    'AN': '유진', 'WON': '원영', 'GA': '가을', 'REI': '레이',
+    'LIZ': '리즈', 'LEE': '이서', 'II': "I've IVE", 'LD': 'LOVE DIVE'
+}
+
+@lru_cache(maxsize=65536)
+def _parse_filename_cached(filename):
+    base = os.path.splitext(filename)[0]
+    tokens = base.split('_')
+    if len(tokens) < 4:
+        return None
+    # 반복되는 group/member/category 문자열은 intern 해서 한 객체만 유지
+    mapped = [sys.intern(FILENAME_TOKEN_MAP.get(t, t)) for t in tokens[:-1]]
+    group, member, category, *middle = mapped
+    title = middle[0] if middle else ''
+    version = middle[1] if len(middle) > 1 else ''
+    return (group, member, category, title, version, tokens[-1])
+
+def parse_filename(filename: str):
+    parsed = _parse_filename_cached(filename)
+    if parsed is None:
+        return None
+    group, member, category, title, version, unique_id = parsed
+    # 호출 측에서 dict 를 수정하므로 매번 새 dict 반환
+    return {
+        'group': group, 'member': member, 'category': category,
+        'title': title, 'version': version, 'unique_id': unique_id
+    }
+
+# ────────────────────────────────────────────
+# 파생 이미지 (thumbs/)
+# ────────────────────────────────────────────
+
+# images/event/xxx.jpg -> thumbs/w240/event/xxx.webp, thumbs/w600/event/xxx.jpg ...
+THUMB_PREFIX = "thumbs"
+THUMB_WIDTHS = (240, 600)   # 목록용 썸네일, 중간 크기
+THUMB_FORMATS = ("webp", "jpg")
+THUMB_ENCODINGS = {
+    # 확장자: (Pillow 형식, content type, 저장 옵션) - webp 가 마지막 (완료 표시)
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+}
+THUMB_CACHE_CONTROL = "public, max-age=86400"
+
+def thumb_blob_name(full_path, width, ext):
+    return f"{THUMB_PREFIX}/w{width}/{os.path.splitext(full_path)[0]}.{ext}"
+
+def render_derivatives(source, full_path):
+    """원본(로컬 경로, 파일 객체 또는 바이트) -> [(blob 이름, 바이트, content type)]
+
+    가장 작은 webp 가 마지막 - 앱은 이 파일이 있으면 나머지도 있다고 봄 (완료 표시).
+    Pillow 는 파생 이미지를 만드는 쪽에서만 필요하므로 여기서 import.
+    """
+    from PIL import Image, ImageOps
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+
+        outputs = []
+        for width in reversed(THUMB_WIDTHS):
+            if img.width > width:
+                height = max(1, round(img.height * width / img.width))
+                resized = img.resize((width, height), Image.LANCZOS)
+            else:
+                resized = img   # 원본보다 크게 늘리지 않음
+            for ext, (fmt, content_type, options) in THUMB_ENCODINGS.items():
+                frame = resized
+                if fmt == "JPEG" and has_alpha:
+                    # JPEG 는 투명도가 없으므로 흰 배경에 합성
+                    frame = Image.new("RGB", resized.size, (255, 255, 255))
+                    frame.paste(resized, mask=resized.getchannel("A"))
+                buf = io.BytesIO()
+                frame.save(buf, fmt, **options)
+                outputs.append((thumb_blob_name(full_path, width, ext), buf.getvalue(), content_type))
+    return outputs
+
+def list_thumbnail_paths(bucket):
+    """파생 이미지가 준비된 원본 경로 집합 - 마지막에 올라가는 가장 작은 webp 로 판단"""
+    prefix = f"{THUMB_PREFIX}/w{THUMB_WIDTHS[0]}/"
+    return {
+        os.path.splitext(blob.name[len(prefix):])[0]
+        for blob in bucket.list_blobs(prefix=prefix, fields="items(name),nextPageToken")
+        if blob.name.endswith(".webp")
+    }
+
+def thumbnail_fields(bucket, full_path):
+    """thumb_url (작은 webp), srcset (webp), srcset_jpeg (webp 미지원 브라우저용)"""
+    urls = {
+        (w, ext): bucket.blob(thumb_blob_name(full_path, w, ext)).public_url
+        for w in THUMB_WIDTHS for ext in THUMB_FORMATS
+    }
+    return {
+        "thumb_url": urls[(THUMB_WIDTHS[0], "webp")],
+        "srcset": ", ".join(f"{urls[(w, 'webp')]} {w}w" for w in THUMB_WIDTHS),
+        "srcset_jpeg": ", ".join(f"{urls[(w, 'jpg')]} {w}w" for w in THUMB_WIDTHS),
+    }
+
+# ────────────────────────────────────────────
+# 카탈로그 항목
+# ────────────────────────────────────────────
+
+def build_image_entry(blob, thumbnails=None):
+    """blob 하나를 카탈로그 항목(dict)으로 변환"""
+    try:
+        # images/ 폴더 제거하고 실제 경로 추출
+        _, full_path = blob.name.split("/", 1)   # images/event/xxx.jpg -> event/xxx.jpg
+    except ValueError:
+        full_path = blob.name
+
+    # 실제 file_type과 filename 분리
+    if "/" in full_path:
+        file_type, filename = full_path.split("/", 1)
+    else:
+        file_type, filename = "unknown", full_path
+
+    # 파일명 파싱 결과를 meta에 담음
+    meta = parse_filename(filename) or {}
+    meta.update({
+        "file_type": file_type,  # "event"
+        "filename": full_path,   # "event/IVE_AN_ARENA_351631.jpg"
+        "url": blob.public_url,
+        "blob_name": blob.name,
+        "updated": blob.updated.isoformat() if blob.updated else ""
+    })
+    # 썸네일이 아직 없으면 필드를 넣지 않음 (클라이언트는 url 사용)
+    if thumbnails and os.path.splitext(full_path)[0] in thumbnails:
+        meta.update(thumbnail_fields(blob.bucket, full_path))
+    return meta
+
+def list_catalog_entries(bucket, executor=None):
+    """버킷 목록 조회로 전체 카탈로그 항목 생성 - executor 가 있으면 썸네일 목록을 동시에 조회"""
+    thumbs_future = executor.submit(list_thumbnail_paths, bucket) if executor else None
+    blobs = [
+        blob for blob in bucket.list_blobs(prefix=f"{IMAGE_PREFIX}/")
+        # 이미지 파일인지 확인
+        if blob.name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    try:
+        thumbnails = thumbs_future.result() if thumbs_future else list_thumbnail_paths(bucket)
+    except Exception as e:
+        print(f"썸네일 목록 조회 오류: {e}")
+        thumbnails = set()
+    return [build_image_entry(blob, thumbnails) for blob in blobs]
+
+# ────────────────────────────────────────────
+# 관리자 검색 (?source=bucket - 캐시를 거치지 않는 조회)
+# ────────────────────────────────────────────
+
+def admin_search_match(name_lower, query, file_type):
+    if file_type and not name_lower.startswith(f"{IMAGE_PREFIX}/{file_type}/"):
+        return False
+    return not query or query in name_lower
+
+def search_bucket_images(bucket, query, file_type, limit):
+    """버킷을 스트리밍으로 훑으며 최근 수정 limit 개만 힙에 유지"""
+    # file_type 필터는 GCS prefix 로 넘겨 목록 자체를 줄임
+    prefix = f"{IMAGE_PREFIX}/{file_type}/" if file_type else f"{IMAGE_PREFIX}/"
+    heap = []  # (updated, 순번, blob) 최소 힙 - 가장 오래된 항목이 맨 앞
+    for seq, blob in enumerate(bucket.list_blobs(prefix=prefix)):
+        name_lower = blob.name.lower()
+        if not name_lower.endswith(IMAGE_EXTENSIONS):
+            continue
+        if not admin_search_match(name_lower, query, file_type):
+            continue
+
+        updated = blob.updated.isoformat() if blob.updated else ""
+        if len(heap) < limit:
+            heapq.heappush(heap, (updated, seq, blob))
+        elif updated > heap[0][0]:
+            heapq.heapreplace(heap, (updated, seq, blob))
+
+    # 파일명 파싱은 최종 선택된 항목에만 수행
+    heap.sort(reverse=True)
+    return [build_image_entry(blob) for _, _, blob in heap]
+
+# ────────────────────────────────────────────
+# 카탈로그 매니페스트 (버킷의 catalog/manifest.json.gz)
+# ────────────────────────────────────────────
+
+# {"version": n, "generated_at": "...", "entries": [build_image_entry 결과, ...]}
+# 버전은 blob metadata 에도 기록 - 앱은 메타데이터만 조회해서 변경 여부 확인
+MANIFEST_BLOB = "catalog/manifest.json.gz"
+MANIFEST_UPDATE_ATTEMPTS = 5
+
+def encode_manifest(manifest):
+    raw = json.dumps(manifest, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return gzip.compress(raw, compresslevel=9)
+
+def decode_manifest(data):
+    manifest = json.loads(gzip.decompress(data).decode("utf-8"))
+    if not isinstance(manifest.get("version"), int) or not isinstance(manifest.get("entries"), list):
+        raise ValueError("invalid catalog manifest")
+    return manifest
+
+def manifest_version(blob):
+    """blob 메타데이터의 버전 (다운로드 없이) - 없으면 None"""
+    try:
+        return int((blob.metadata or {}).get("version"))
+    except (TypeError, ValueError):
+        return None
+
+def load_manifest_file(path):
+    """함께 배포한 매니페스트 파일 - 없으면 None"""
+    try:
+        with open(path, "rb") as f:
+            return decode_manifest(f.read())
+    except FileNotFoundError:
+        return None
+
+def save_manifest_file(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_manifest(manifest))
+    os.replace(tmp_path, path)
+
+def publish_manifest(bucket, manifest, generation):
+    """세대 조건부 업로드 - 다른 곳에서 먼저 바꿨으면 412 오류"""
+    blob = bucket.blob(MANIFEST_BLOB)
+    blob.cache_control = "no-cache"
+    blob.metadata = {"version": str(manifest["version"])}
+    blob.upload_from_string(
+        encode_manifest(manifest),
+        content_type="application/gzip",
+        if_generation_match=generation
+    )
+
+def update_manifest(bucket, upserts=(), removals=(), seed=None, rebuild=False):
+    """매니페스트에 항목 추가/교체(upserts)와 삭제(removals, blob 이름)를 반영하고 버전 증가
+
+    매니페스트가 없으면 seed() 결과로 시작 (seed 가 없으면 아무것도 하지 않고 None).
+    rebuild=True 면 기존 항목을 버리고 seed() 결과로 교체.
+    동시에 갱신되어 조건부 쓰기가 실패하면 다시 읽어서 재시도.
+    """
+    for attempt in range(MANIFEST_UPDATE_ATTEMPTS):
+        current = bucket.get_blob(MANIFEST_BLOB)
+        if current is None:
+            if seed is None:
+                return None
+            version, generation, entries = 0, 0, seed()
+        else:
+            manifest = decode_manifest(current.download_as_bytes())
+            version, generation = manifest["version"], current.generation
+            entries = seed() if rebuild else manifest["entries"]
+
+        by_name = {e["blob_name"]: e for e in entries}
+        for name in removals:
+            by_name.pop(name, None)
+        for entry in upserts:
+            by_name[entry["blob_name"]] = entry
+
+        manifest = {
+            "version": version + 1,
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "entries": list(by_name.values())
+        }
+        try:
+            publish_manifest(bucket, manifest, generation)
+            return manifest
+        except Exception as e:
+            if getattr(e, "code", None) != 412:
+                raise
+            time.sleep(0.2 * (attempt + 1))
+    raise RuntimeError("catalog manifest update conflict")
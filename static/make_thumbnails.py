@@ -0,0 +1,136 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from upload_images import initialize_firebase, with_retries, publish_catalog
+from catalog_manifest import (
+    THUMB_PREFIX, THUMB_WIDTHS, THUMB_CACHE_CONTROL, IMAGE_EXTENSIONS, thumb_blob_name, render_derivatives
+)
+
+# 파생 이미지 경로 규칙과 인코딩 설정은 catalog_manifest.py (앱의 관리자 업로드와 공유)
+# images/event/IVE_AN_ARENA_351631.jpg -> thumbs/w240/event/IVE_AN_ARENA_351631.webp (.jpg)
+#                                      -> thumbs/w600/event/IVE_AN_ARENA_351631.webp (.jpg)
+# 카탈로그에 포함되는 원본 확장자
+SOURCE_EXTENSIONS = IMAGE_EXTENSIONS
+
+# 한 원본의 파생 이미지를 순서대로 업로드 (완료 표시 파일이 마지막)
+def upload_derivatives(bucket, outputs, max_retries=5):
+    for name, data, content_type in outputs:
+        blob = bucket.blob(name)
+        blob.cache_control = THUMB_CACHE_CONTROL
+        with_retries(
+            lambda: blob.upload_from_string(data, content_type=content_type, predefined_acl='publicRead'),
+            max_retries
+        )
+    return len(outputs)
+
+def _load_source(source):
+    # 버킷 원본은 내려받고, 로컬 파일은 경로 그대로 (프로세스에서 직접 읽음)
+    if hasattr(source, 'download_as_bytes'):
+        return source.download_as_bytes()
+    return source
+
+def generate_derivatives(bucket, sources, workers=None, upload_workers=16, max_retries=5, batch_size=200):
+    """sources: [(원본 로컬 경로 또는 blob, 원본 상대 경로)]
+
+    디코딩/리사이즈/인코딩은 CPU 코어 수만큼의 프로세스에서, 다운로드/업로드는 스레드에서 처리.
+    반환값: (업로드한 파생 이미지 수, [(상대 경로, 오류)])
+    """
+    uploaded = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=upload_workers) as io_pool, \
+            tqdm(total=len(sources), desc="썸네일 생성") as progress:
+        # 원본을 메모리에 한꺼번에 올리지 않도록 나눠서 처리
+        for start in range(0, len(sources), batch_size):
+            batch = sources[start:start + batch_size]
+
+            loads = {io_pool.submit(_load_source, source): rel_path for source, rel_path in batch}
+            renders = {}
+            for future in as_completed(loads):
+                rel_path = loads[future]
+                try:
+                    renders[cpu_pool.submit(render_derivatives, future.result(), rel_path)] = rel_path
+                except Exception as e:
+                    failed.append((rel_path, str(e)))
+                    progress.update(1)
+
+            uploads = {}
+            for future in as_completed(renders):
+                rel_path = renders[future]
+                try:
+                    uploads[io_pool.submit(upload_derivatives, bucket, future.result(), max_retries)] = rel_path
+                except Exception as e:
+                    failed.append((rel_path, str(e)))
+                    progress.update(1)
+
+            for future in as_completed(uploads):
+                try:
+                    uploaded += future.result()
+                except Exception as e:
+                    failed.append((uploads[future], str(e)))
+                progress.update(1)
+
+    return uploaded, failed
+
+# 백필 - 버킷의 원본 중 파생 이미지가 없는 것만 생성
+def main():
+    config = {
+        'images_prefix': 'images',  # 원본 경로 접두사
+        'workers': None,            # 이미지 처리 프로세스 수 (None 이면 CPU 코어 수)
+        'upload_workers': 16,       # 동시 다운로드/업로드 수
+        'max_retries': 5,
+        'force': False,             # True 면 이미 있는 파생 이미지도 다시 생성
+        'update_manifest': True     # 썸네일 필드를 카탈로그 매니페스트에 반영
+    }
+
+    print("Firebase 초기화 중...")
+    bucket = initialize_firebase()
+
+    prefix = config['images_prefix']
+    originals = [
+        blob for blob in bucket.list_blobs(prefix=f"{prefix}/")
+        if blob.name.lower().endswith(SOURCE_EXTENSIONS)
+    ]
+    # 완료 표시 파일(가장 작은 webp)만 확인
+    marker_width = THUMB_WIDTHS[0]
+    existing = {
+        blob.name for blob in bucket.list_blobs(prefix=f"{THUMB_PREFIX}/w{marker_width}/")
+    }
+
+    sources = []
+    for blob in originals:
+        rel_path = blob.name[len(prefix) + 1:]
+        if config['force'] or thumb_blob_name(rel_path, marker_width, 'webp') not in existing:
+            sources.append((blob, rel_path))
+
+    print(f"원본 {len(originals)}개 중 생성 필요: {len(sources)}개")
+    if not sources:
+        return
+
+    start_time = time.time()
+    uploaded, failed = generate_derivatives(
+        bucket, sources, config['workers'], config['upload_workers'], config['max_retries']
+    )
+    for rel_path, error in failed:
+        print(f"실패: {rel_path} -> {error}")
+
+    failed_paths = {rel_path for rel_path, _ in failed}
+    done = [(blob, rel_path) for blob, rel_path in sources if rel_path not in failed_paths]
+    if config['update_manifest'] and done:
+        try:
+            catalog = publish_catalog(
+                bucket, [blob for blob, _ in done], {os.path.splitext(rel_path)[0] for _, rel_path in done}
+            )
+            print(f"카탈로그 매니페스트 v{catalog['version']}: {len(catalog['entries'])}개 항목")
+        except Exception as e:
+            print(f"카탈로그 매니페스트 갱신 실패: {e}")
+
+    print("\n===== 썸네일 생성 결과 =====")
+    print(f"대상 원본: {len(sources)}개")
+    print(f"업로드한 파생 이미지: {uploaded}개")
+    print(f"실패: {len(failed)}개")
+    print(f"총 소요 시간: {time.time() - start_time:.2f}초")
+
+if __name__ == "__main__":
+    main()
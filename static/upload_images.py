@@ -1,11 +1,27 @@
 import os
+import sys
 import glob
 import mimetypes
 import time
 import json
+import base64
+import hashlib
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import firebase_admin
 from firebase_admin import credentials, storage
+from google.api_core import exceptions as gcs_exceptions
+
+# 저장소 루트의 catalog_manifest.py (app.py 와 같은 카탈로그 항목/매니페스트 형식)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalog_manifest import (
+    IMAGE_EXTENSIONS, build_image_entry, list_catalog_entries, list_thumbnail_paths, update_manifest,
+    save_manifest_file
+)
+
+# 앱과 함께 배포하는 매니페스트 사본 - 앱 기동 직후 버킷 조회 없이 카탈로그 응답
+BUNDLED_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog_manifest.json.gz')
 
 # Firebase 인증 및 초기화
 def initialize_firebase():
@@ -27,11 +43,67 @@ def find_image_files(source_dir):
         all_files.extend(glob.glob(f"{source_dir}/**/*{ext}", recursive=True))
         all_files.extend(glob.glob(f"{source_dir}/**/*{ext.upper()}", recursive=True))
     
+    # 대소문자를 구분하지 않는 파일 시스템(윈도우)에서는 같은 파일이 두 번 잡힘
+    all_files = sorted(set(all_files))
+    
     print(f"총 {len(all_files)}개의 이미지 파일을 찾았습니다.")
     return all_files
 
-# 파일 업로드
-def upload_file(bucket, local_path, destination_path, skip_existing=True):
+# MIME 타입 추측
+def guess_content_type(local_path):
+    content_type, _ = mimetypes.guess_type(local_path)
+    if not content_type and local_path.lower().endswith('.jpg'):
+        content_type = 'image/jpeg'
+    elif not content_type:
+        content_type = 'application/octet-stream'
+    return content_type
+
+# 파일 내용 해시 (GCS 의 md5_hash 와 같은 base64 형식)
+def file_md5(local_path):
+    md5 = hashlib.md5()
+    with open(local_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode('ascii')
+
+def load_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+# 중간에 중단되어도 파일이 깨지지 않도록 임시 파일에 쓴 뒤 교체
+def save_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+# 대상 경로의 기존 파일 목록을 한 번에 가져오기 - {경로: blob} (md5_hash, 카탈로그용 메타데이터 포함)
+def list_existing(bucket, prefix):
+    return {blob.name: blob for blob in bucket.list_blobs(prefix=f"{prefix}/")}
+
+# 일시적인 오류(네트워크, 429, 5xx)만 재시도
+def is_retryable(error):
+    if isinstance(error, gcs_exceptions.GoogleAPICallError):
+        return error.code in (408, 429) or (error.code or 0) >= 500
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+# 일시적인 오류면 지수 백오프(+지터)로 재시도 - (결과, 재시도 횟수) 반환
+def with_retries(fn, max_retries=5, base_delay=1.0):
+    attempt = 0
+    while True:
+        try:
+            return fn(), attempt
+        except Exception as e:
+            attempt += 1
+            if attempt > max_retries or not is_retryable(e):
+                raise
+            time.sleep(base_delay * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+# 파일 업로드 (재시도 + 지수 백오프)
+def upload_file(bucket, local_path, destination_path, max_retries=5, base_delay=1.0, overwrite=False):
     try:
         # 파일명 검증 - 원본 파일명이 유지되는지 확인
         original_filename = os.path.basename(local_path)
@@ -40,44 +112,56 @@ def upload_file(bucket, local_path, destination_path, skip_existing=True):
         if original_filename != dest_filename:
             raise ValueError(f"파일명이 변경되었습니다! 원본: {original_filename}, 대상: {dest_filename}")
         
-        # 파일 존재 여부 확인
+        content_type = guess_content_type(local_path)
         blob = bucket.blob(destination_path)
-        if skip_existing and blob.exists():
-            return {'success': True, 'skipped': True, 'path': destination_path, 'message': '이미 존재함'}
-        
-        # MIME 타입 추측
-        content_type, _ = mimetypes.guess_type(local_path)
-        if not content_type and local_path.lower().endswith('.jpg'):
-            content_type = 'image/jpeg'
-        elif not content_type:
-            content_type = 'application/octet-stream'
         
-        # 메타데이터 설정
-        metadata = {'contentType': content_type}
+        def upload():
+            try:
+                # 업로드와 공개 설정을 한 번의 요청으로
+                # if_generation_match=0: 없을 때만 생성 - 응답을 못 받고 재시도해도 중복 업로드 없음
+                blob.upload_from_filename(
+                    local_path,
+                    content_type=content_type,
+                    predefined_acl='publicRead',
+                    if_generation_match=None if overwrite else 0
+                )
+            except gcs_exceptions.PreconditionFailed:
+                # 이전 시도가 이미 성공했거나 다른 곳에서 먼저 올림
+                pass
         
-        # 업로드
-        blob.upload_from_filename(local_path, content_type=content_type)
-        
-        # 공개 URL 생성
-        blob.make_public()
-        public_url = blob.public_url
+        _, attempt = with_retries(upload, max_retries, base_delay)
         
         return {
-            'success': True, 
-            'skipped': False, 
+            'success': True,
+            'skipped': False,
             'path': destination_path,
-            'url': public_url,
+            'url': blob.public_url,
+            'retries': attempt,
             'message': '업로드 성공'
         }
-        
+    
     except Exception as e:
         return {
-            'success': False, 
-            'path': local_path, 
+            'success': False,
+            'path': local_path,
             'error': str(e),
             'message': '업로드 실패'
         }
 
+# 카탈로그 매니페스트에 원본 blob 들을 추가/교체하고 배포용 사본도 저장
+# thumbnails: 파생 이미지가 준비된 원본 상대 경로(확장자 제외) 집합
+def publish_catalog(bucket, blobs, thumbnails=(), bundle_path=BUNDLED_MANIFEST_PATH):
+    upserts = [
+        build_image_entry(blob, set(thumbnails))
+        for blob in blobs
+        if blob.name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    # 매니페스트가 아직 없으면 버킷 전체 목록으로 시작
+    manifest = update_manifest(bucket, upserts=upserts, seed=lambda: list_catalog_entries(bucket))
+    if bundle_path:
+        save_manifest_file(bundle_path, manifest)
+    return manifest
+
 # 메인 함수
 def main():
     # !!! 주의: 파일명과 폴더 구조는 반드시 유지되어야 합니다 !!!
@@ -88,7 +172,14 @@ def main():
         'source_dir': 'E:\pocali-backend\static\images',           # 로컬 이미지 폴더
         'destination_prefix': 'images',     # Firebase 저장 경로 접두사
         'preserve_structure': True,         # 폴더 구조 유지 여부 (변경 금지)
-        'skip_existing': True               # 이미 존재하는 파일 건너뛰기
+        'skip_existing': True,              # 이미 존재하는 파일 건너뛰기
+        'workers': 16,                      # 동시 업로드 수
+        'max_retries': 5,                   # 파일별 재시도 횟수
+        'manifest_path': 'upload_manifest.json',       # 이어 올리기용 기록 (경로, 크기, 수정 시각, 해시)
+        'mapping_path': 'firebase_url_mapping.json',
+        'save_every': 50,                   # 몇 개 처리마다 기록/매핑 파일 저장
+        'make_thumbnails': True,            # 새로 올린 원본의 썸네일/중간 크기(thumbs/) 생성
+        'update_manifest': True             # 카탈로그 매니페스트(catalog/manifest.json.gz)에 반영
     }
     
     # 폴더 구조 유지 설정을 강제로 True로 설정
@@ -96,10 +187,6 @@ def main():
         print("경고: 폴더 구조 유지 설정이 False로 되어 있습니다. 웹앱 호환성을 위해 True로 변경합니다.")
         config['preserve_structure'] = True
     
-    # Firebase 초기화
-    print("Firebase 초기화 중...")
-    bucket = initialize_firebase()
-    
     # 이미지 파일 찾기
     print(f"{config['source_dir']} 폴더에서 이미지 검색 중...")
     files = find_image_files(config['source_dir'])
@@ -108,39 +195,173 @@ def main():
         print("업로드할 이미지가 없습니다.")
         return
     
+    prefix = config['destination_prefix']
+    manifest = load_json(config['manifest_path'], {})
+    url_mapping = load_json(config['mapping_path'], {})
+    
     # 결과 저장용 변수
     results = []
     successful = 0
     skipped = 0
+    unchanged = 0
+    mismatched = 0
     failed = 0
+    uploaded_files = []
     
     # 시작 시간
     start_time = time.time()
     
-    # 파일 업로드
-    for file_path in tqdm(files, desc="업로드 중"):
+    # 1) 기록과 크기/수정 시각이 같은 파일은 네트워크 없이 건너뜀
+    pending = []
+    for file_path in files:
         # 상대 경로 계산
         rel_path = os.path.relpath(file_path, config['source_dir'])
         
         # 저장 경로 결정 (폴더 구조 무조건 유지)
-        dest_path = os.path.join(config['destination_prefix'], rel_path)
+        dest_path = os.path.join(prefix, rel_path)
         
         # 경로 구분자 정규화 (윈도우에서도 작동하도록)
         dest_path = dest_path.replace('\\', '/')
         
-        # 업로드
-        result = upload_file(bucket, file_path, dest_path, config['skip_existing'])
-        results.append(result)
+        stat = os.stat(file_path)
+        entry = manifest.get(dest_path)
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            unchanged += 1
+            continue
+        pending.append((file_path, dest_path, stat))
+    
+    # 기록은 되었지만 카탈로그 매니페스트에 아직 반영되지 않은 파일 (이전 실행이 중간에 끊긴 경우)
+    unpublished = [
+        dest_path for dest_path, entry in manifest.items() if entry.get('published') is False
+    ] if config['update_manifest'] else []
+    
+    print(f"변경 없음 (기록 일치): {unchanged}개, 확인 필요: {len(pending)}개, 카탈로그 미반영: {len(unpublished)}개")
+    
+    def record(file_path, dest_path, stat, md5, url):
+        manifest[dest_path] = {
+            'path': file_path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'md5': md5,
+            'published': False  # 카탈로그 매니페스트에 반영되면 True
+        }
+        # 상대 경로를 키로 사용 (폴더 정보 포함)
+        url_mapping[dest_path[len(prefix) + 1:]] = url
+    
+    def save_progress():
+        save_json(config['manifest_path'], manifest)
+        save_json(config['mapping_path'], url_mapping)
+    
+    if pending or unpublished:
+        # Firebase 초기화
+        print("Firebase 초기화 중...")
+        bucket = initialize_firebase()
         
-        # 결과 카운팅
-        if result['success']:
-            if result.get('skipped'):
+        # 2) 대상 경로 목록을 한 번만 조회
+        existing = {}
+        if pending and config['skip_existing']:
+            print(f"{prefix}/ 기존 파일 목록 조회 중...")
+            existing = list_existing(bucket, prefix)
+            print(f"기존 파일: {len(existing)}개")
+        
+        uploads = []
+        for file_path, dest_path, stat in pending:
+            md5 = file_md5(file_path)
+            if dest_path in existing:
+                if existing[dest_path].md5_hash != md5:
+                    # 기록하지 않음 - 다음 실행에서도 다시 확인 (교체하려면 skip_existing=False 로 덮어쓰기)
+                    print(f"경고: 내용이 다른 파일이 이미 있음 (건너뜀, 기록 안 함): {dest_path}")
+                    results.append({'success': False, 'skipped': True, 'path': dest_path, 'message': '내용이 다른 파일이 이미 있음'})
+                    mismatched += 1
+                    continue
+                record(file_path, dest_path, stat, md5, bucket.blob(dest_path).public_url)
+                results.append({'success': True, 'skipped': True, 'path': dest_path, 'message': '이미 존재함'})
                 skipped += 1
             else:
-                successful += 1
-        else:
-            failed += 1
-            print(f"실패: {file_path} -> {result.get('error', '알 수 없는 오류')}")
+                uploads.append((file_path, dest_path, stat, md5))
+        save_progress()
+        
+        # 3) 없는 파일만 동시에 업로드하고, 끝나는 대로 기록/매핑 갱신
+        try:
+            with ThreadPoolExecutor(max_workers=config['workers']) as pool:
+                futures = {
+                    pool.submit(
+                        upload_file, bucket, file_path, dest_path, config['max_retries'],
+                        overwrite=not config['skip_existing']
+                    ): (file_path, dest_path, stat, md5)
+                    for file_path, dest_path, stat, md5 in uploads
+                }
+                done = 0
+                for future in tqdm(as_completed(futures), total=len(futures), desc="업로드 중"):
+                    file_path, dest_path, stat, md5 = futures[future]
+                    result = future.result()
+                    results.append(result)
+                    
+                    # 결과 카운팅
+                    if result['success']:
+                        successful += 1
+                        record(file_path, dest_path, stat, md5, result['url'])
+                        uploaded_files.append((file_path, dest_path))
+                    else:
+                        failed += 1
+                        print(f"실패: {file_path} -> {result.get('error', '알 수 없는 오류')}")
+                    
+                    done += 1
+                    if done % config['save_every'] == 0:
+                        save_progress()
+        finally:
+            # 중단되더라도 끝난 파일까지는 기록 - 다시 실행하면 이어서 진행
+            save_progress()
+        
+        # 4) 새로 올린 원본의 파생 이미지 생성 (기존 원본은 make_thumbnails.py 로 백필)
+        thumbnail_paths = set()
+        if config['make_thumbnails']:
+            from make_thumbnails import generate_derivatives, SOURCE_EXTENSIONS
+            sources = [
+                (file_path, dest_path[len(prefix) + 1:])
+                for file_path, dest_path in uploaded_files
+                if file_path.lower().endswith(SOURCE_EXTENSIONS)
+            ]
+            if sources:
+                thumbnails, thumb_failed = generate_derivatives(bucket, sources, max_retries=config['max_retries'])
+                print(f"썸네일: {thumbnails}개 업로드, 실패 {len(thumb_failed)}개")
+                for rel_path, error in thumb_failed:
+                    print(f"썸네일 실패: {rel_path} -> {error}")
+                failed_paths = {rel_path for rel_path, _ in thumb_failed}
+                thumbnail_paths = {
+                    os.path.splitext(rel_path)[0] for _, rel_path in sources if rel_path not in failed_paths
+                }
+        
+        # 5) 기록은 되었지만 아직 반영되지 않은 원본 전부(이번에 올린 파일, 이미 버킷에 있던 파일,
+        #    이전 실행에서 끊긴 파일)를 카탈로그 매니페스트에 반영 (앱은 버킷 목록 조회 없이 이 파일을 읽음)
+        to_publish = [
+            dest_path for dest_path, entry in manifest.items() if entry.get('published') is False
+        ] if config['update_manifest'] else []
+        if to_publish:
+            uploaded_paths = {dest_path for _, dest_path in uploaded_files}
+            # 수정 시각 등 메타데이터가 필요 - 목록 조회로 받은 blob 은 그대로, 나머지만 다시 조회
+            refetch = [dest_path for dest_path in to_publish if dest_path not in existing]
+            with ThreadPoolExecutor(max_workers=config['workers']) as pool:
+                fetched = dict(zip(refetch, pool.map(bucket.get_blob, refetch)))
+            blobs = []
+            for dest_path in to_publish:
+                blob = existing.get(dest_path) or fetched.get(dest_path)
+                if blob is None:
+                    # 버킷에서 사라진 파일은 기록을 지워 다음 실행에서 다시 업로드
+                    manifest.pop(dest_path, None)
+                else:
+                    blobs.append(blob)
+            # 이번에 올리지 않은 원본은 썸네일이 이미 있을 수 있으므로 버킷에서 확인
+            if any(dest_path not in uploaded_paths for dest_path in to_publish):
+                thumbnail_paths |= list_thumbnail_paths(bucket)
+            try:
+                catalog = publish_catalog(bucket, blobs, thumbnail_paths)
+                print(f"카탈로그 매니페스트 v{catalog['version']}: {len(catalog['entries'])}개 항목")
+                for blob in blobs:
+                    manifest[blob.name]['published'] = True
+                save_progress()
+            except Exception as e:
+                print(f"카탈로그 매니페스트 갱신 실패 (다음 실행에서 다시 반영, 또는 앱의 /djemals/api/catalog/rebuild): {e}")
     
     # 소요 시간
     elapsed_time = time.time() - start_time
@@ -150,6 +371,8 @@ def main():
     print(f"총 파일: {len(files)}개")
     print(f"성공: {successful}개")
     print(f"건너뜀 (이미 존재): {skipped}개")
+    print(f"건너뜀 (변경 없음): {unchanged}개")
+    print(f"건너뜀 (내용 다름, 미기록): {mismatched}개")
     print(f"실패: {failed}개")
     print(f"총 소요 시간: {elapsed_time:.2f}초")
     
@@ -159,6 +382,8 @@ def main():
         'total': len(files),
         'successful': successful,
         'skipped': skipped,
+        'unchanged': unchanged,
+        'mismatched': mismatched,
         'failed': failed,
         'results': results
     }
@@ -167,20 +392,8 @@ def main():
         json.dump(result_json, f, ensure_ascii=False, indent=2)
     
     print("결과가 upload_results.json 파일에 저장되었습니다.")
-    
-    # URL 매핑 파일 생성 (웹앱 연동용)
-    url_mapping = {}
-    for result in results:
-        if result['success'] and 'url' in result:
-            # 상대 경로를 키로 사용 (폴더 정보 포함)
-            rel_path = result['path'].replace(f"{config['destination_prefix']}/", '')
-            url_mapping[rel_path] = result['url']
-    
-    with open('firebase_url_mapping.json', 'w', encoding='utf-8') as f:
-        json.dump(url_mapping, f, ensure_ascii=False, indent=2)
-    
-    print("URL 매핑이 firebase_url_mapping.json 파일에 저장되었습니다.")
+    print(f"URL 매핑이 {config['mapping_path']} 파일에 저장되었습니다.")
     print("이 파일을 사용하여 웹앱의 이미지 URL을 Firebase로 쉽게 변경할 수 있습니다.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()